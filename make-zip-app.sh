@@ -10,4 +10,11 @@ rsync -a ${BASE}/tktooltip                       zipapp/
 rsync -a ${BASE}/tkinter_tooltip-3.1.0.dist-info zipapp/
 rsync -a obs_cr                                  zipapp/
 
+# Ship bytecode next to the sources, so that startup doesn't compile
+# everything each time (a zipapp can't cache it).  zipimport uses
+# legacy-location .pyc files (-b); unchecked-hash skips comparing them
+# with the sources.  Other Python versions fall back to the sources.
+find zipapp -name __pycache__ -prune -exec rm -rf {} +
+python3 -m compileall -q -b --invalidation-mode unchecked-hash zipapp
+
 python -m zipapp zipapp --main=obs_cr.__main__:main --python="/usr/bin/env python3" --output obs-cr.pyz
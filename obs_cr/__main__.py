@@ -6,6 +6,8 @@ Run one of the panels within python-cr.  Give an argument of `preview` or `contr
 
     python obs-cr.pyz preview host:port password
     python obs-cr.pyz control host:port password
+    python obs-cr.pyz relay host:port password --listen host:port
+    python obs-cr.pyz mock --listen host:port
 """)
 
 def main():
@@ -30,6 +32,14 @@ def main():
             print("Zipapps can't handle complied modules")
             exit(1)
         preview.main()
+
+    elif cmd == 'relay':
+        from . import relay
+        relay.main()
+
+    elif cmd == 'mock':
+        from . import mockobs
+        mockobs.main()
     else:
         print_help()
         sys.exit(1)
@@ -0,0 +1,229 @@
+"""Benchmarks of the control panel against a mock OBS.
+
+This runs the real panel (control.py) against mockobs.MockObs with a
+simulated round trip time, and measures for each hot action how many
+websocket messages and requests it sends and how long it takes until
+everything it started is done.  Panel startup is measured for different
+numbers of presets and indicators.
+
+    python -m obs_cr.bench --rtt 20 --output before.json
+    ... change things ...
+    python -m obs_cr.bench --rtt 20 --compare before.json
+
+Each measurement runs in a new process, since the panel is made only
+once per process.  Tk needs a display (use xvfb-run on a server); the
+windows are hidden once the panel is set up.
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LOG = logging.getLogger(__name__)
+
+QUIET = 0.05  # s without anything in flight before an action counts as done
+ACTIONS = ['quick_break', 'quick_back_go', 'preset_switch', 'scene_switch', 'pip_size', 'pip_crop',
+           'indicator']
+
+
+
+#
+# In the child process
+#
+def _panel(rtt, presets, indicators):
+    """Start a mock OBS and the panel.  Returns (control module, mock)."""
+    from . import mockobs
+    from . import control
+    control.PRESETS = [(f'preset-{i}', f'P{i}') for i in range(presets)]
+    control.INDICATORS = [(f'bench{i}', f'I{i}', 'cyan', '', { }) for i in range(indicators)]
+    # The mock only delays what it sends, so that is the whole round trip
+    mock = mockobs.start(latency=rtt/1000,
+                         scenes=list(control.SCENE_NAMES), pip_scenes=control.SCENES_WITH_PIP,
+                         audio_inputs=[control.AUDIO_INPUT, control.AUDIO_INPUT_BRCD],
+                         media_inputs=[control.PLAYBACK_INPUT])
+    return control, mock
+
+def _busy(control):
+    """Anything still in flight?"""
+    engine = control.obsreq.engine
+    return bool(engine._pending) or not control.dispatch._queue.empty()
+
+def _settle(control):
+    """Run Tk until nothing is in flight for QUIET.  Returns the time when it last was."""
+    last = time.perf_counter()
+    while True:
+        control.root.update()
+        now = time.perf_counter()
+        if _busy(control):
+            last = now
+        elif now - last > QUIET:
+            return last
+        time.sleep(0.001)
+
+def _counts(mock):
+    return sum(mock.received.values()), sum(mock.stats.values())
+
+def _find(widget, cls):
+    """All descendants of widget that are instances of cls"""
+    found = [ ]
+    for child in widget.winfo_children():
+        if isinstance(child, cls):
+            found.append(child)
+        found.extend(_find(child, cls))
+    return found
+
+def child_startup(args):
+    start = time.perf_counter()
+    control, mock = _panel(args.rtt, args.presets, args.indicators)
+    host, port = mock.server_address
+    control.main([f'{host}:{port}', '', '--no-pip-poll'], mainloop=False)
+    control.root.withdraw()
+    end = _settle(control)
+    messages, requests = _counts(mock)
+    return {'presets': args.presets, 'indicators': args.indicators,
+            'startup_s': end - start, 'messages': messages, 'requests': requests}
+
+def child_actions(args):
+    control, mock = _panel(args.rtt, args.presets, args.indicators)
+    host, port = mock.server_address
+    control.main([f'{host}:{port}', '', '--no-pip-poll'], mainloop=False)
+    control.root.withdraw()
+    _settle(control)
+    obs = control.obs
+    preset = control.Preset._instances[0]
+    obs[f'preset-{preset.name}-sbox'] = 'Screenshare'
+    obs[f'preset-{preset.name}-rbox'] = control.SCENE_SIZES[0]
+    control.quick_jingle.click(False)
+    qbg = _find(control.root, control.QuickBackGo)[0]
+    qbg.menu.value.set('Screenshare')
+    quick_break = _find(control.root, control.QuickBreak)[0]
+    indicator = control.indicators[control.INDICATORS[0][0]]
+    _settle(control)
+
+    actions = {
+        'quick_break':   lambda i: quick_break.click(),
+        'quick_back_go': lambda i: qbg.click(),
+        'preset_switch': lambda i: preset._switch_to(),
+        'scene_switch':  lambda i: control.switch(['Notes', 'Gallery'][i%2]),
+        'pip_size':      lambda i: control.pip_size.update([0.3, 0.5][i%2]),
+        'pip_crop':      lambda i: control.pip_crop([1, 2][i%2]),
+        'indicator':     lambda i: indicator.click(),
+        }
+    results = { }
+    for name in ACTIONS:
+        latencies, messages, requests = [ ], [ ], [ ]
+        for i in range(args.repeat):
+            if name == 'preset_switch':
+                control.switch('Title')  # so that it switches to a remote scene each time
+                _settle(control)
+            messages0, requests0 = _counts(mock)
+            start = time.perf_counter()
+            actions[name](i)
+            end = _settle(control)
+            latencies.append(end - start)
+            messages1, requests1 = _counts(mock)
+            messages.append(messages1 - messages0)
+            requests.append(requests1 - requests0)
+        results[name] = {'latency_s': statistics.median(latencies),
+                         'messages': statistics.median(messages),
+                         'requests': statistics.median(requests)}
+    return results
+
+
+
+#
+# In the main process
+#
+def _run_child(args, *child_args):
+    cmd = [sys.executable, '-m', 'obs_cr.bench', '--rtt', str(args.rtt), '--repeat', str(args.repeat),
+           *child_args]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE, check=True,
+                          cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    # The panel prints things, the result is the last line
+    return json.loads(proc.stdout.decode().strip().split('\n')[-1])
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(old, new, threshold):
+    """Print the differences, return the number of regressions."""
+    regressions = 0
+    def row(name, o, n):
+        nonlocal regressions
+        flags = [ ]
+        if n['messages'] > o['messages']:
+            flags.append('MORE MESSAGES')
+        if n['requests'] > o['requests']:
+            flags.append('MORE REQUESTS')
+        key = 'latency_s' if 'latency_s' in n else 'startup_s'
+        if n[key] > o[key] * threshold and n[key] - o[key] > QUIET:
+            flags.append('SLOWER')
+        regressions += bool(flags)
+        print(f"{name:24} {o['messages']:5g} -> {n['messages']:<5g} {o['requests']:5g} -> {n['requests']:<5g}"
+              f" {o[key]*1000:8.1f} -> {n[key]*1000:<8.1f} {' '.join(flags)}")
+    print(f"{'':24} {'messages':14} {'requests':14} {'ms':20}")
+    for name in new['actions']:
+        if name in old['actions']:
+            row(name, old['actions'][name], new['actions'][name])
+    old_startup = {(x['presets'], x['indicators']): x for x in old['startup']}
+    for x in new['startup']:
+        if (x['presets'], x['indicators']) in old_startup:
+            row(f"startup p={x['presets']} i={x['indicators']}", old_startup[x['presets'], x['indicators']], x)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the control panel against a mock OBS.")
+    parser.add_argument('--rtt', type=float, default=20, help="Simulated round trip time, ms (default %(default)s)")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs of each action (default %(default)s)")
+    parser.add_argument('--sizes', default='0,6,24',
+                        help="Numbers of presets and indicators for the startup times (default %(default)s)")
+    parser.add_argument('--output', '-o', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Compare with the results in this JSON file")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="With --compare, report latencies this many times the old as slower (default %(default)s)")
+    parser.add_argument('--child', choices=['startup', 'actions'], help=argparse.SUPPRESS)
+    parser.add_argument('--presets', type=int, default=6, help=argparse.SUPPRESS)
+    parser.add_argument('--indicators', type=int, default=8, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.child:
+        result = {'startup': child_startup, 'actions': child_actions}[args.child](args)
+        sys.stdout.flush()
+        print(json.dumps(result))
+        os._exit(0)  # don't wait for the connection threads
+
+    results = {'commit': _git_commit(), 'rtt_ms': args.rtt, 'repeat': args.repeat,
+               'actions': _run_child(args, '--child', 'actions'), 'startup': [ ]}
+    for n in [int(x) for x in args.sizes.split(',')]:
+        results['startup'].append(_run_child(args, '--child', 'startup', '--presets', str(n),
+                                             '--indicators', str(n)))
+
+    for name, r in results['actions'].items():
+        print(f"{name:24} {r['messages']:3g} messages {r['requests']:3g} requests {r['latency_s']*1000:8.1f} ms")
+    for r in results['startup']:
+        print(f"startup p={r['presets']:<3} i={r['indicators']:<3}    {r['messages']:3g} messages "
+              f"{r['requests']:3g} requests {r['startup_s']*1000:8.1f} ms")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"\nCompared with {args.compare} (commit {old.get('commit')}, rtt {old.get('rtt_ms')} ms):")
+        if compare(old, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,446 @@
+"""Connection helpers for obs-websocket beyond what obsws_python provides.
+
+obsws_python's ReqClient sends one request and then blocks until its
+response arrives, and its EventClient needs a second websocket for the
+events.  Here, RequestEngine instead keeps one websocket with a reader
+thread: requests can be sent from any thread, many can be in flight at
+once, each returns a concurrent.futures.Future, and events arrive on the
+same connection.  AsyncReqClient gives this the same methods as
+ReqClient, and Supervisor reconnects when the connection drops.
+"""
+
+from concurrent.futures import Future
+from functools import partial
+import itertools
+import json
+import logging
+import threading
+import time
+
+import obsws_python
+from obsws_python.baseclient import ObsClient
+from obsws_python.callback import Callback
+from obsws_python.error import OBSSDKError, OBSSDKRequestError, OBSSDKTimeoutError
+from obsws_python.util import as_dataclass
+from websocket import WebSocketTimeoutException
+
+LOG = logging.getLogger(__name__)
+
+Subs = obsws_python.Subs
+# Which event subscription category each event is in
+EVENT_SUBS = {
+    'ExitStarted': Subs.GENERAL,
+    'CustomEvent': Subs.GENERAL,
+    'VendorEvent': Subs.VENDORS,
+    **dict.fromkeys(['CurrentSceneCollectionChanging', 'CurrentSceneCollectionChanged',
+                     'SceneCollectionListChanged', 'CurrentProfileChanging',
+                     'CurrentProfileChanged', 'ProfileListChanged'], Subs.CONFIG),
+    **dict.fromkeys(['SceneCreated', 'SceneRemoved', 'SceneNameChanged',
+                     'CurrentProgramSceneChanged', 'CurrentPreviewSceneChanged',
+                     'SceneListChanged'], Subs.SCENES),
+    **dict.fromkeys(['InputCreated', 'InputRemoved', 'InputNameChanged',
+                     'InputSettingsChanged', 'InputMuteStateChanged', 'InputVolumeChanged',
+                     'InputAudioBalanceChanged', 'InputAudioSyncOffsetChanged',
+                     'InputAudioTracksChanged', 'InputAudioMonitorTypeChanged'], Subs.INPUTS),
+    'InputVolumeMeters': Subs.INPUTVOLUMEMETERS,
+    'InputActiveStateChanged': Subs.INPUTACTIVESTATECHANGED,
+    'InputShowStateChanged': Subs.INPUTSHOWSTATECHANGED,
+    **dict.fromkeys(['CurrentSceneTransitionChanged', 'CurrentSceneTransitionDurationChanged',
+                     'SceneTransitionStarted', 'SceneTransitionEnded',
+                     'SceneTransitionVideoEnded'], Subs.TRANSITIONS),
+    **dict.fromkeys(['SourceFilterListReindexed', 'SourceFilterCreated', 'SourceFilterRemoved',
+                     'SourceFilterNameChanged', 'SourceFilterSettingsChanged',
+                     'SourceFilterEnableStateChanged'], Subs.FILTERS),
+    **dict.fromkeys(['StreamStateChanged', 'RecordStateChanged', 'RecordFileChanged',
+                     'ReplayBufferStateChanged', 'VirtualcamStateChanged',
+                     'ReplayBufferSaved'], Subs.OUTPUTS),
+    **dict.fromkeys(['SceneItemCreated', 'SceneItemRemoved', 'SceneItemListReindexed',
+                     'SceneItemEnableStateChanged', 'SceneItemLockStateChanged',
+                     'SceneItemSelected'], Subs.SCENEITEMS),
+    'SceneItemTransformChanged': Subs.SCENEITEMTRANSFORMCHANGED,
+    **dict.fromkeys(['MediaInputPlaybackStarted', 'MediaInputPlaybackEnded',
+                     'MediaInputActionTriggered'], Subs.MEDIAINPUTS),
+    **dict.fromkeys(['StudioModeStateChanged', 'ScreenshotSaved'], Subs.UI),
+    }
+
+def subscriptions(event_names):
+    """The event subscription bitmask needed to get these events.
+
+    Unknown events subscribe to all low-volume events, to be safe.
+    """
+    subs = 0
+    for name in event_names:
+        if name not in EVENT_SUBS:
+            LOG.warning('Unknown event %r, subscribing to all low-volume events', name)
+        subs |= EVENT_SUBS.get(name, Subs.LOW_VOLUME)
+    return subs
+
+
+class RequestEngine:
+    """Asynchronous, pipelined requests (and events) over one websocket.
+
+    request() and request_batch() can be called from any thread and
+    return Futures.  Responses are matched to requests by requestId in
+    a background thread, so they may arrive in any order.  Requests that
+    get no response within `timeout` seconds fail with OBSSDKTimeoutError.
+
+    A request batch (RequestBatch) runs many requests in one message,
+    which costs one round trip instead of one per request.
+
+    Events of the categories in `subs` (obsws_python.Subs) are given to
+    on_event(eventType, eventData), in the reader thread.
+    """
+    def __init__(self, host, port, password, timeout=3, subs=0, on_event=None, metrics=None):
+        self.timeout = timeout
+        self.on_event = on_event
+        self.subs = subs
+        self.metrics = metrics
+        self.base_client = ObsClient(host=host, port=port, password=password, timeout=timeout,
+                                     subs=subs)
+        self.base_client.authenticate()
+        self.ws = self.base_client.ws
+        # The reader wakes up this often to expire timed out requests
+        self.ws.settimeout(min(timeout, 0.5))
+        self.closed = False
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._pending = { }  # requestId: (future, deadline, raw)
+        self._thread = threading.Thread(target=self._read, daemon=True,
+                                        name='obs-request-engine')
+        self._thread.start()
+
+    def request(self, request_type, request_data=None, raw=False):
+        """Send one request.  The future's result is the response data."""
+        d = {'requestType': request_type}
+        if request_data:
+            d['requestData'] = request_data
+        future = self._send(6, d, raw)
+        if self.metrics is not None:
+            self.metrics.request(request_type, future)
+        return future
+
+    def request_batch(self, requests, halt_on_failure=False, raw=False):
+        """Send (requestType, requestData) pairs as one RequestBatch.
+
+        The future's result is the response data of each request, in the
+        same order.  A request that failed gives None (and is logged)
+        instead of failing the whole batch.
+        """
+        if not requests:
+            future = Future()
+            future.set_result([ ])
+            return future
+        d = {
+            'haltOnFailure': halt_on_failure,
+            'executionType': 0,  # SerialRealtime
+            'requests': [ ],
+            }
+        for i, (request_type, request_data) in enumerate(requests):
+            request = {'requestType': request_type, 'requestId': str(i)}
+            if request_data:
+                request['requestData'] = request_data
+            d['requests'].append(request)
+        future = self._send(8, d, raw)
+        if self.metrics is not None:
+            self.metrics.request('RequestBatch', future, [r[0] for r in requests])
+        return future
+
+    def forward(self, op, d):
+        """Send a request (op 6) or request batch (op 8) message as it is.
+
+        The future's result is the whole response message data, whether
+        the request succeeded or not.  d is not modified.
+        """
+        future = self._send(op, dict(d), None)
+        if self.metrics is not None:
+            if op == 8:
+                self.metrics.request('RequestBatch', future, [r['requestType'] for r in d['requests']])
+            else:
+                self.metrics.request(d['requestType'], future)
+        return future
+
+    def _send(self, op, d, raw):
+        future = Future()
+        request_id = d['requestId'] = str(next(self._ids))
+        LOG.debug('Sending request %s', d)
+        with self._lock:
+            if self.closed:
+                future.set_exception(OBSSDKError("Connection to OBS is closed"))
+                return future
+            self._pending[request_id] = (future, time.monotonic() + self.timeout, raw)
+            try:
+                self.ws.send(json.dumps({'op': op, 'd': d}))
+            except Exception as e:  # pylint: disable=broad-except
+                del self._pending[request_id]
+                future.set_exception(e)
+        return future
+
+    def _read(self):
+        """Reader thread: resolve the futures as responses arrive."""
+        while not self.closed:
+            try:
+                message = self.ws.recv()
+            except WebSocketTimeoutException:
+                self._expire()
+                continue
+            except Exception as e:  # pylint: disable=broad-except
+                if not self.closed:
+                    LOG.error('Connection to OBS lost: %s: %s', type(e).__name__, e)
+                break
+            if not message:
+                continue
+            message = json.loads(message)
+            if message['op'] == 5:
+                self._event(message['d'])
+            elif message['op'] == 7:
+                self._resolve(message['d'], self._response)
+            elif message['op'] == 9:
+                self._resolve(message['d'], self._batch_response)
+            self._expire()
+        with self._lock:
+            self.closed = True
+            pending, self._pending = self._pending, { }
+        for future, _, _ in pending.values():
+            future.set_exception(OBSSDKError("Connection to OBS is closed"))
+
+    def _event(self, d):
+        LOG.debug('Event received %s', d)
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(d['eventType'], d.get('eventData') or { })
+        except Exception:  # pylint: disable=broad-except
+            LOG.exception('Exception in event handler for %s', d['eventType'])
+
+    def _resolve(self, d, func):
+        with self._lock:
+            future, _, raw = self._pending.pop(d['requestId'], (None, None, None))
+        if future is None:
+            LOG.debug('Response to unknown (expired?) request: %s', d)
+            return
+        LOG.debug('Response received %s', d)
+        if raw is None:  # forward()
+            future.set_result(d)
+            return
+        try:
+            future.set_result(func(d, raw))
+        except OBSSDKError as e:
+            LOG.error('%s: %s', type(e).__name__, e)
+            future.set_exception(e)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.exception('Invalid response %s', d)
+            future.set_exception(e)
+
+    @staticmethod
+    def _response(d, raw):
+        status = d['requestStatus']
+        if not status['result']:
+            raise OBSSDKRequestError(d['requestType'], status['code'], status.get('comment'))
+        if 'responseData' in d:
+            if raw:
+                return d['responseData']
+            return as_dataclass(d['requestType'], d['responseData'])
+        return None
+
+    @staticmethod
+    def _batch_response(d, raw):
+        results = [None] * len(d['results'])
+        for result in d['results']:
+            i = int(result['requestId'])
+            if not result['requestStatus']['result']:
+                LOG.error('Batch request %s failed: %s', result['requestType'], result['requestStatus'])
+                continue
+            data = result.get('responseData', { })
+            if not raw:
+                data = as_dataclass(result['requestType'], data)
+            results[i] = data
+        return results
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [request_id for (request_id, (_, deadline, _)) in self._pending.items()
+                       if deadline < now]
+            expired = [self._pending.pop(request_id)[0] for request_id in expired]
+        for future in expired:
+            LOG.error('Timeout waiting for OBS response')
+            future.set_exception(OBSSDKTimeoutError("Timeout while waiting for the response"))
+
+    def reidentify(self, subs):
+        """Change the event subscriptions of this connection"""
+        LOG.debug('Reidentify with event subscriptions %r', subs)
+        self.subs = subs
+        with self._lock:
+            self.ws.send(json.dumps({'op': 3, 'd': {'eventSubscriptions': int(subs)}}))
+
+    def close(self):
+        self.closed = True
+        self.ws.close()
+
+
+
+class AsyncReqClient(obsws_python.ReqClient):
+    """obsws_python.ReqClient, but requests run on a RequestEngine.
+
+    All of the ReqClient methods work, but return a Future instead of
+    the result (writes can ignore it).  send_batch() sends a RequestBatch.
+    """
+    def __init__(self, engine):  # pylint: disable=super-init-not-called
+        self.logger = LOG.getChild(self.__class__.__name__)
+        self.engine = engine
+        self.base_client = engine.base_client
+
+    def send(self, param, data=None, raw=False):
+        return self.engine.request(param, data, raw=raw)
+
+    def send_batch(self, requests, halt_on_failure=False, raw=False):
+        return self.engine.request_batch(requests, halt_on_failure=halt_on_failure, raw=raw)
+
+    def disconnect(self):
+        self.engine.close()
+
+
+
+class _Callback(Callback):
+    """obsws_python's Callback, also running on_change() when handlers are added"""
+    def __init__(self, on_change):
+        super().__init__()
+        self.on_change = on_change
+    def register(self, fns):
+        super().register(fns)
+        self.on_change()
+
+
+
+class Supervisor:
+    """Keep the connection to OBS up, reconnecting when it drops.
+
+    This makes the RequestEngine and watches it from a background thread.
+    If it drops, or OBS stops answering pings, it is made again, retrying
+    with exponential backoff.  `req` (an AsyncReqClient) and `callback`
+    (the event callback registry, as in obsws_python.EventClient) stay
+    the same objects throughout, so their users don't notice.  The
+    functions in `on_reconnect` are run (in the supervisor thread) after
+    each reconnection.  The functions in `on_event` get every event as
+    (eventType, eventData), before the callbacks.
+
+    Only the event categories that the registered handlers need are
+    subscribed to (plus `subs`), so OBS doesn't send the rest.  The
+    connection is re-identified when handlers are added.
+
+    If `metrics` (a metrics.Metrics) is given, all requests and events
+    are recorded in it.
+
+    Events are handled with call(func, *args), for example
+    TkDispatcher.call to run the handlers in the Tk thread.  By default
+    they run in the reader thread, so handlers must not wait for
+    responses.
+    """
+    BACKOFF_MIN = 0.1  # s
+    BACKOFF_MAX = 1    # s
+    PING = 5           # s, check a quiet connection this often
+    def __init__(self, host, port, password, timeout=3, subs=0, call=None, metrics=None):
+        self._args = dict(host=host, port=port, password=password, timeout=timeout, metrics=metrics)
+        self.metrics = metrics
+        self.subs = subs
+        self.call = call
+        self._resubscribe_pending = False
+        self.callback = _Callback(on_change=self._resubscribe)
+        self.on_reconnect = [ ]
+        self.on_event = [ ]
+        self.closed = False
+        self._connect()  # The first time, errors go to the caller
+        self.req = AsyncReqClient(self.engine)
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='obs-supervisor')
+        self._thread.start()
+
+    def _connect(self):
+        self.engine = RequestEngine(on_event=self._event, subs=self.planned_subs(), **self._args)
+
+    def planned_subs(self):
+        """Event subscriptions needed by the registered handlers"""
+        return self.subs | subscriptions(self.callback.get())
+
+    def subscribe(self, subs):
+        """Set the event subscriptions needed besides the registered handlers"""
+        self.subs = subs
+        self._resubscribe()
+
+    def _resubscribe(self):
+        # Handlers are usually registered many at a time, so re-identify
+        # only once after they are all in, if we have a way to do that.
+        if self.call is not None:
+            if not self._resubscribe_pending:
+                self._resubscribe_pending = True
+                self.call(self._do_resubscribe)
+            return
+        self._do_resubscribe()
+
+    def _do_resubscribe(self):
+        self._resubscribe_pending = False
+        subs = self.planned_subs()
+        if hasattr(self, 'engine') and not self.engine.closed and subs != self.engine.subs:
+            try:
+                self.engine.reidentify(subs)
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.error('Could not re-identify: %s: %s', type(e).__name__, e)
+
+    def _event(self, event_type, data):
+        for func in self.on_event:
+            func(event_type, data)
+        if self.metrics is None:
+            trigger = self.callback.trigger
+        else:
+            trigger = partial(self._trigger, time.monotonic())
+        if self.call is None:
+            trigger(event_type, data)
+        else:
+            self.call(trigger, event_type, data)
+
+    def _trigger(self, received, event_type, data):
+        """callback.trigger, recording the event in the metrics"""
+        started = time.monotonic()
+        try:
+            self.callback.trigger(event_type, data)
+        finally:
+            self.metrics.event(event_type, received, started, time.monotonic())
+
+    def _run(self):
+        last_ping = time.monotonic()
+        while not self.closed:
+            time.sleep(self.BACKOFF_MIN)
+            if not self.engine.closed and time.monotonic() - last_ping > self.PING:
+                last_ping = time.monotonic()
+                try:
+                    self.engine.request('GetVersion').result()
+                except OBSSDKTimeoutError:
+                    LOG.error('OBS is not answering')
+                    self.engine.close()
+                except OBSSDKError:
+                    pass
+            if not self.engine.closed or self.closed:
+                continue
+            LOG.warning('Connection to OBS lost, reconnecting')
+            delay = self.BACKOFF_MIN
+            while not self.closed:
+                try:
+                    self._connect()
+                    break
+                except Exception as e:  # pylint: disable=broad-except
+                    LOG.info('Reconnecting failed (%s: %s), retrying in %.1f s', type(e).__name__, e, delay)
+                    time.sleep(delay)
+                    delay = min(delay * 2, self.BACKOFF_MAX)
+            else:
+                break
+            LOG.warning('Reconnected to OBS')
+            if self.metrics is not None:
+                self.metrics.reconnected()
+            self.req.engine = self.engine
+            self.req.base_client = self.engine.base_client
+            for func in self.on_reconnect:
+                func()
+
+    def close(self):
+        self.closed = True
+        self.engine.close()
@@ -9,11 +9,14 @@ import math
 import random
 import subprocess
 import textwrap
+import threading
 import time
+import uuid
 
 from tkinter import *  # pylint: disable=wildcard-import,unused-wildcard-import
 from tkinter import ttk
-from tktooltip import ToolTip
+
+from .util import PhaseTimer, Repaint, TkDispatcher, then
 
 # pylint: disable=redefined-outer-name
 
@@ -81,6 +84,26 @@ PLAYBACK_FILES = [
      'label': 'long',
      'tooltip': 'Long theme song for starting/ending day, 1:23 duration'},
     ]
+# Synced indicator lights: (name, label, color, tooltip, kwargs)
+INDICATORS = [
+    ('warning',  'Warn',     'red',    'Master warning: some urgent issue, please check.', {'blink': 500}),
+    ('caution',  'Caution',  'yellow', 'Master caution: some issue, please check.', {}),
+    ('time',     'Time',     'yellow', 'General "check time" indicator.', {}),
+    ('notes',    'Notes',    'cyan',   'General "check shared notes" indicator.', {}),
+    ('question', 'Question', 'cyan',   'Important question, check chat or notes', {}),
+    ('chat',     'Chat',     'cyan',   'Check chat indicator', {}),
+    ('slower',     '<',      'yellow', 'Slower', {}),
+    ('faster',     '>',      'yellow', 'Faster', {}),
+    ]
+# Scene presets: (name, label), laid out in two columns
+PRESETS = [
+    ('preset-a', "A"),
+    ('preset-b', "B"),
+    ('preset-c', "C"),
+    ('preset-d', "D"),
+    ('preset-e', "E"),
+    ('preset-f', "F"),
+    ]
 PIP_CROP_FACTORS = {
     None: {'top':  0, 'bottom':  0, 'left':  0, 'right':  0, },
     1:    {'top':  0, 'bottom':  0, 'left': 59, 'right':  59, },
@@ -104,12 +127,25 @@ class ObsState:
       - broadcasts it as a custom event (which every other dict gets)
       - saves it as OBS persistent state
     - Getting an attribute
-      - Gets it from persistent state
+      - Gets it from the local cache (kept up to date by local sets and
+        by the custom events).  It never waits for OBS: a key that isn't
+        cached yet is None, and is fetched in the background; its
+        watchers run when the value arrives.
     - Watching an attribute
       - Watches for those custom events and will trigger the callback
         each time the attribute is updated
     - The _watch_init() method installs a callback, and calls it once
       with the saved value.
+    - Until _hydrate() is called (at the end of startup), these initial
+      callbacks are deferred, and then all values are fetched from OBS
+      in one request batch.
+    - _resync() (after a reconnection) fetches everything again in one
+      batch, and runs the watchers only of the keys that changed.
+    - Every value has a version (seq, writer): a per-key sequence number
+      and a random ID of the panel that set it.  Both the saved values
+      and the custom events carry it, and older versions are ignored.
+      Since all panels compare versions the same way, panels that set a
+      key at the same time still end up agreeing.
 
     The combination of OBS persistent state and OBS custom events allows
     clients to get updates as soon as a value is changed, but also sync
@@ -118,15 +154,32 @@ class ObsState:
     ATTRS = {
         ''
         }
+    # Keys that aren't persistent data but are read with another request:
+    # name: (requestType, requestData, responseField).  More are added
+    # with _request_key().
+    REQUEST_KEYS = {
+        'scene': ('GetCurrentProgramScene', None, 'currentProgramSceneName'),
+        'muted': ('GetInputMute', {'inputName': AUDIO_INPUT}, 'inputMuted'),
+        'muted_brcd': ('GetInputMute', {'inputName': AUDIO_INPUT_BRCD}, 'inputMuted'),
+        }
     _LOG = logging.getLogger('ObsState')
     def __init__(self, obsreq, obsev):
         super().__setattr__('_req', obsreq)
         super().__setattr__('_ev', obsev)
         super().__setattr__('_watchers', collections.defaultdict(set))
+        super().__setattr__('_cache', { })
+        super().__setattr__('_versions', { })  # name: (seq, writer)
+        super().__setattr__('_writer', uuid.uuid4().hex[:12])
+        super().__setattr__('_lock', threading.RLock())
+        super().__setattr__('_pending', [ ])  # (name, func) waiting for _hydrate()
+        super().__setattr__('_fetching', set())  # uncached keys being fetched by _get()
+        super().__setattr__('REQUEST_KEYS', dict(self.REQUEST_KEYS))
         super().__setattr__('_dir', set(dir(self)))
 
-        watching_funcs = [func
-                          for (name, func) in inspect.getmembers(self, predicate=inspect.ismethod)
+        # Look the methods up on the class, so that the properties don't
+        # each make a request.
+        watching_funcs = [getattr(self, name)
+                          for (name, func) in inspect.getmembers(type(self), predicate=inspect.isfunction)
                           if name.startswith('on_')
                           ]
         self._LOG.debug('Registering functions: %s', watching_funcs)
@@ -135,96 +188,254 @@ class ObsState:
     def __getattr__(self, name):
         if name.startswith('_'):
             raise AttributeError(f'Invalid attribute {name!r}')
-        data = self._req.get_persistent_data('OBS_WEBSOCKET_DATA_REALM_PROFILE', name)
-        value = getattr(data, 'slot_value', None)
-        self._LOG.debug('obs.getattr {name!r}={value!r}')
+        value = self._get(name)
+        self._LOG.debug('obs.getattr %r=%r', name, value)
         return value
     __getitem__ = __getattr__
 
+    def _get(self, name):
+        """The cached value of name.
+
+        If it isn't cached yet, return None and fetch it.  The watchers
+        of name run when it arrives.
+        """
+        if name in self._cache:
+            return self._cache[name]
+        if name not in self._fetching:
+            self._fetching.add(name)
+            def done(values):
+                self._fetching.discard(name)
+                self._run_watchers(name, values[name])
+            self._fetch([name], done)
+        return None
+
     def __setattr__(self, name, value):
         if name in self._dir:
             super().__setattr__(name, value)
         if name.startswith('_'):
             raise AttributeError(f'Invalid attribute {name!r}')
-        self._LOG.debug('obs.setattr %r=%r', name, value)
-        self._req.set_persistent_data('OBS_WEBSOCKET_DATA_REALM_PROFILE', name, value)
-        self._req.broadcast_custom_event({'eventData': {name: value}})
-        if cli_args.test:
-            self.on_custom_event(type('dummy', (), {name: value, 'attrs': lambda: [name]}))
+        with self._lock:
+            version = (self._versions.get(name, (0, ''))[0] + 1, self._writer)
+            self._LOG.debug('obs.setattr %r=%r version=%r', name, value, version)
+            self._cache[name] = value
+            self._versions[name] = version
+        self._save(name)
+        # Our own event will come back, but it is ignored as not newer.
+        self._run_watchers(name, value)
     __setitem__ = __setattr__
 
+    def _save(self, name):
+        """Save the current value and version of name as persistent data,
+        and send it to the other panels as a custom event."""
+        value, (seq, writer) = self._cache[name], self._versions[name]
+        self._req.set_persistent_data('OBS_WEBSOCKET_DATA_REALM_PROFILE', name,
+                                      {'value': value, 'seq': seq, 'writer': writer})
+        self._req.broadcast_custom_event({'eventData': {name: value, '_sync': {name: [seq, writer]}}})
+
+    def _update(self, name, value, version):
+        """Accept a value from OBS, if it is newer than what we have.
+
+        Returns True if it was accepted.  Values without a version (from
+        before versioning) are always accepted.
+        """
+        with self._lock:
+            current = self._versions.get(name)
+            if version is not None and current is not None and version <= current:
+                if version < current and current[1] == self._writer:
+                    # Someone saved an older value, possibly overwriting our
+                    # newer one.  Save ours again so new panels get it.  We
+                    # may not be the newest writer either (its event may not
+                    # have arrived yet), so the event makes a newer writer
+                    # save again in turn.
+                    self._LOG.debug('obs._update %r: stale %r, re-saving %r', name, version, current)
+                    self._save(name)
+                return False
+            self._cache[name] = value
+            if version is not None:
+                self._versions[name] = version
+            return True
+
     def __hasattr__(self, name):
         self._LOG.debug('obs.hasattr %r', name)
         if name.startswith('_'):
             raise AttributeError(f'Invalid attribute {name!r}')
-        data = self._req.get_persistent_data('OBS_WEBSOCKET_DATA_REALM_PROFILE', name)
-        value = getattr(data, 'slot_value', None)
+        value = getattr(self, name)
         if value is None:
             return False
         return True
 
+    def _request_key(self, name, request_type, request_data, field):
+        """Make key `name` be read by another request than persistent data.
+
+        This is for state that OBS has itself (like mute status), so
+        that it is fetched in the same batches.  The event handlers below
+        keep these up to date.
+        """
+        self.REQUEST_KEYS[name] = (request_type, request_data, field)
+
+    def _send_fetch(self, names):
+        """Send a request batch for these keys.  Returns a future."""
+        requests = [ ]
+        for name in names:
+            if name in self.REQUEST_KEYS:
+                request_type, request_data, _ = self.REQUEST_KEYS[name]
+                requests.append((request_type, request_data))
+            else:
+                requests.append(('GetPersistentData', {'realm': 'OBS_WEBSOCKET_DATA_REALM_PROFILE',
+                                                       'slotName': name}))
+        return self._req.send_batch(requests, raw=True)
+
+    def _apply_fetch(self, names, results):
+        """Merge the results of _send_fetch() into the cache.
+
+        Returns the names whose values changed.
+        """
+        changed = [ ]
+        # A failed batch request gives None
+        for name, data in zip(names, results or [None] * len(names)):
+            old = self._cache.get(name)
+            if name in self.REQUEST_KEYS:
+                self._cache[name] = (data or { }).get(self.REQUEST_KEYS[name][2])
+            else:
+                # If a newer custom event arrived meanwhile, it is kept.
+                self._update(name, *self._unpack((data or { }).get('slotValue')))
+            if self._cache[name] != old:
+                changed.append(name)
+        return changed
+
+    def _fetch(self, names, func=None):
+        """Fetch these keys from OBS in one request batch, and cache them.
+
+        Then run func({name: value}) in the Tk thread.
+        """
+        def done(results):
+            self._apply_fetch(names, results)
+            if func is not None:
+                func({name: self._cache[name] for name in names})
+        dispatch.on_result(self._send_fetch(names), done)
+
+    def _resync(self):
+        """Fetch all watched keys again, and run the watchers of the ones that changed.
+
+        Used after reconnecting, when events may have been missed.
+        """
+        names = list(self._watchers)
+        self._LOG.debug('obs._resync fetching %r', names)
+        def done(results):
+            for name in self._apply_fetch(names, results):
+                self._LOG.info('obs._resync %r changed to %r', name, self._cache[name])
+                self._run_watchers(name, self._cache[name])
+        dispatch.on_result(self._send_fetch(names), done)
+
+    @staticmethod
+    def _unpack(saved):
+        """Persistent data value → (value, version)"""
+        if isinstance(saved, dict) and set(saved) == {'value', 'seq', 'writer'}:
+            return saved['value'], (saved['seq'], saved['writer'])
+        return saved, (0, '')  # saved before versioning
+
+    def _hydrate(self, then=None):
+        """Fetch every key asked for during startup, then run the initial callbacks.
+
+        The callbacks (and then(), if given) run in the Tk thread once the
+        values arrive.  Until then, new initial callbacks are deferred too.
+        """
+        pending = self._pending
+        names = list(dict.fromkeys(name for (name, func) in pending if name not in self._cache))
+        self._LOG.debug('obs._hydrate %d callbacks, fetching %r', len(pending), names)
+        def done(values):
+            super(ObsState, self).__setattr__('_pending', None)
+            for name, func in pending:
+                self._init(name, func)
+            if then is not None:
+                then()
+        self._fetch(names, done)
+
     def on_custom_event(self, event):
         """Watcher for custom events"""
         self._LOG.debug('custom event %r (%r)', event, event.attrs())
+        versions = getattr(event, '_sync', { })
         for attr in event.attrs():
-            if attr in self._watchers:
-                for func in self._watchers[attr]:
-                    self._LOG.debug('custom event attr=%r func=%s', attr, func)
-                    func(getattr(event, attr))
+            if attr == '_sync':
+                continue
+            version = tuple(versions[attr]) if attr in versions else None
+            if not self._update(attr, getattr(event, attr), version):
+                self._LOG.debug('custom event attr=%r version=%r is not newer, ignored', attr, version)
+                continue
+            self._run_watchers(attr, getattr(event, attr))
+
+    def _run_watchers(self, name, value):
+        for func in list(self._watchers.get(name, ())):
+            self._LOG.debug('watcher attr=%r func=%s', name, func)
+            func(value)
 
     def _watch(self, name, func):
         """Set a watcher for updates of this key"""
         self._LOG.debug('obs._watch add %r=%s', name, func)
         self._watchers[name].add(func)
 
+    def _init(self, name, func):
+        """Run the callback once with the current value of this key.
+
+        Before _hydrate(), this is deferred until then.  A key that isn't
+        cached is fetched first."""
+        if self._pending is not None:
+            self._pending.append((name, func))
+            return
+        if name in self._cache:
+            func(self._cache[name])
+        else:
+            self._fetch([name], lambda values: func(values[name]))
+
     def _watch_init(self, name, func):
         """Set a watcher for this key.  Also run the callback once with the current value."""
         self._LOG.debug('obs._watch_init add %r=%s', name, func)
         self._watchers[name].add(func)
-        func(getattr(self, name))
+        self._init(name, func)
 
     # Custom properties
     @property
     def scene(self):
-        value = self._req.get_current_program_scene().current_program_scene_name
+        value = self._get('scene')
         self._LOG.debug('obs.scene get scene=%r', value)
         return value
     @scene.setter
     def scene(self, value):
         self._LOG.debug('obs.scene set scene=%r', value)
         self._req.set_current_program_scene(value)
-        if cli_args.test:
-            self.on_current_program_scene_changed(type('dummy', (), {'scene_name': value}))
     def on_current_program_scene_changed(self, data):
+        self._cache['scene'] = data.scene_name
         for func in self._watchers['scene']:
             self._LOG.debug('obs.scene watch scene %r', func)
             func(data.scene_name)
 
     @property
     def muted(self):
-        return self._req.get_input_mute(AUDIO_INPUT).input_muted
+        return self._get('muted')
     @muted.setter
     def muted(self, value):
         self._req.set_input_mute(AUDIO_INPUT, value)
-        if cli_args.test:
-            self.on_input_mute_state_changed(type('dummy', (), {'input_muted': value}))
     @property
     def muted_brcd(self):
-        return self._req.get_input_mute(AUDIO_INPUT).input_muted
+        return self._get('muted_brcd')
     @muted_brcd.setter
     def muted_brcd(self, value):
-        self._req.set_input_mute(AUDIO_INPUT, value)
-        if cli_args.test:
-            self.on_input_mute_state_changed(type('dummy', (), {'input_muted': value}))
+        self._req.set_input_mute(AUDIO_INPUT_BRCD, value)
     def on_input_mute_state_changed(self, data):
         print(f"Mute {data.input_name!r} to {data.input_muted!r}")
+        self._cache[f'input-muted-{data.input_name}'] = data.input_muted
+        self._run_watchers(f'input-muted-{data.input_name}', data.input_muted)
         for ctrl, name in [
             (AUDIO_INPUT, 'muted'),
             (AUDIO_INPUT_BRCD, 'muted_brcd'),
             ]:
             if data.input_name == ctrl:
+                self._cache[name] = data.input_muted
                 for func in self._watchers[name]:
                     func(data.input_muted)
+    def on_input_volume_changed(self, data):
+        self._cache[f'input-volume-{data.input_name}'] = data.input_volume_db
+        self._run_watchers(f'input-volume-{data.input_name}', data.input_volume_db)
 
 
 
@@ -357,16 +568,75 @@ def notes_scroll(value):
         subprocess.call(cmd)
 
 
+class Throttle:
+    """Rate-limit calls to func, coalescing the calls in between.
+
+    Calling this runs func at most `rate` times per second.  Calls that
+    come too soon are held back, and only the newest arguments are kept
+    (older ones are dropped), so the last value is always sent.  Used for
+    sliders, which otherwise would send a request on every tick.
+    """
+    def __init__(self, widget, func, rate):
+        self.widget = widget  # for .after()
+        self.func = func
+        self.interval = 1 / rate
+        self._last = 0  # time.monotonic() of the last call
+        self._args = None
+        self._after_id = None
+    def __call__(self, *args):
+        self._args = args
+        if self._after_id is not None:
+            return  # already scheduled, it will use the new args
+        wait = self._last + self.interval - time.monotonic()
+        if wait <= 0:
+            self._run()
+        else:
+            self._after_id = self.widget.after(math.ceil(wait*1000), self._run)
+    def _run(self):
+        self._after_id = None
+        self._last = time.monotonic()
+        self.func(*self._args)
+
 
 
 #
 # GUI setup
 #
-root = Tk()
-
-default_color = root.cget("background")
-default_activecolor = default_color
-color_default = {'background': default_color, 'activebackground': default_color}
+# These are made in main()
+root = None
+repaint = None
+default_color = default_activecolor = color_default = None
+
+def init_tk():
+    """Make the Tk root window and what depends on it"""
+    global root, repaint, default_color, default_activecolor, color_default
+    root = Tk()
+    # Widget colors and texts that change with the OBS state are set through
+    # this, so that no-op and repeated updates don't repaint.
+    repaint = Repaint(root)
+
+    default_color = root.cget("background")
+    default_activecolor = default_color
+    color_default = {'background': default_color, 'activebackground': default_color}
+
+# Tooltips are only made after the panel is shown, since importing
+# tktooltip takes a while.  See attach_tooltips().
+_tooltips = [ ]
+def ToolTip(widget, msg, **kwargs):  # pylint: disable=invalid-name
+    """tktooltip.ToolTip, made once the panel is shown"""
+    if _tooltips is None:
+        from tktooltip import ToolTip as ToolTip_
+        return ToolTip_(widget, msg, **kwargs)
+    _tooltips.append((widget, msg, kwargs))
+    return None
+
+def attach_tooltips():
+    """Make the tooltips that were asked for until now"""
+    global _tooltips
+    from tktooltip import ToolTip as ToolTip_
+    pending, _tooltips = _tooltips, None
+    for widget, msg, kwargs in pending:
+        ToolTip_(widget, msg, **kwargs)
 
 
 
@@ -377,13 +647,9 @@ class IndicatorLight(Helper, Button):
         self.blink = blink
         self.label = label
         super().__init__(frm, text=label, command=self.click, **kwargs)
-        saved_state = obs[event_name]
         self.state = None
         self.blink_id = None
-        if saved_state:
-            self.state = saved_state
-        self.update_(self.state)
-        obs._watch(event_name, self.update_)
+        obs._watch_init(event_name, self.update_)
     def click(self):
         self.state = not self.state
         print(f"Indicator {self.label!r} -> {self.state}")
@@ -393,20 +659,20 @@ class IndicatorLight(Helper, Button):
         self.state = state
         print(f"OBS: Indicator {self.label!r} -> {self.state}")
         if self.state:
-            self.configure(background=self.color, activebackground=self.color)
+            repaint.configure(self, background=self.color, activebackground=self.color)
             if self.blink:
                 blink_id = self.blink_id = random.randint(0, 2**64-1)
                 self.after(self.blink, self.do_blink, blink_id, False)
         else:
-            self.configure(background=default_color, activebackground=default_color)
+            repaint.configure(self, background=default_color, activebackground=default_color)
     def do_blink(self, blink_id, next_state):
         """Callback to blink.  Each time flips blink on/off until self.state is not true."""
         if self.blink_id != blink_id or not self.state:
             return
         if next_state:
-            self.configure(background=self.color, activebackground=self.color)
+            repaint.configure(self, background=self.color, activebackground=self.color)
         else:
-            self.configure(background=default_color, activebackground=default_color)
+            repaint.configure(self, background=default_color, activebackground=default_color)
         self.after(self.blink, self.do_blink, blink_id, not next_state)
 
 class IndicatorMasterLive(Helper, Button):
@@ -419,11 +685,13 @@ class IndicatorMasterLive(Helper, Button):
         self.state = { }
         super().__init__(frm, text=label, state='disabled', tooltip=tooltip, **kwargs)
     def update_(self, name, value):
+        if name in self.state and self.state[name] == value:
+            return
         self.state[name] = value
         if any(self.state.values()):
-            self.configure(background=self.color, activebackground=self.color)
+            repaint.configure(self, background=self.color, activebackground=self.color)
         else:
-            self.configure(background=default_color, activebackground=default_color)
+            repaint.configure(self, background=default_color, activebackground=default_color)
     def tt_msg(self):
         return '\n'.join([self.tt_default] + [f'RED: {k!r} ({v!r})' for k,v in self.state.items() if v])
     def on_custom_event(self, event):
@@ -447,15 +715,14 @@ class QuickBack(Helper, ttk.Button):
     def __init__(self, frm, scene, text, **kwargs):
         self.scene = scene
         super().__init__(frm, command=self.click, text=text, **kwargs)
-    def click(self):
-        import threading
-        threading.Thread(target=self.run).start()
-    def run(self):
-        mute[AUDIO_INPUT].click(False)
-        if quick_jingle.instate(('selected', )):
-            playback_buttons['short'].play()
-            time.sleep(3)
-            quick_jingle.state(('!selected',))
+    def click(self, phase=1):
+        if phase == 1:
+            mute[AUDIO_INPUT].click(False)
+            if quick_jingle.instate(('selected', )):
+                playback_buttons['short'].play()
+                # Wait for the jingle without blocking the GUI
+                return self.after(3000, partial(self.click, phase=2))
+        quick_jingle.state(('!selected',))
         switch(self.scene)
         pip_size.restore_last()
 
@@ -470,13 +737,14 @@ class SceneButton(Helper, Button):
                          state='normal' if selectable else 'disabled',
                          **kwargs)
         self._instances.append(self)
-        if not cli_args.test:
-            current_scene = obs.scene
-            if current_scene == scene_name:
-                self.update_(True)
-                indicators['live'].update_('scene-visible', scene_name if (scene_name not in SCENES_SAFE) else '')
-                LOG.info("Init: Current scene %r", current_scene)
+        obs._init('scene', self.init_scene)
         obs._watch('scene', self.switched)
+    def init_scene(self, current_scene):
+        """Initial coloring, with the scene at startup"""
+        if current_scene == self.scene_name:
+            self.update_(True)
+            indicators['live'].update_('scene-visible', self.scene_name if (self.scene_name not in SCENES_SAFE) else '')
+            LOG.info("Init: Current scene %r", current_scene)
     @classmethod
     def switch(self, name):
         """Trigger a switch"""
@@ -499,7 +767,7 @@ class SceneButton(Helper, Button):
             color = ACTIVE
         else:
             color = default_color
-        self.configure(background=color, activebackground=color)
+        repaint.configure(self, background=color, activebackground=color)
 
 class SceneLabel(SyncedLabel):
     scene_label = ''
@@ -529,7 +797,7 @@ class SceneLabel(SyncedLabel):
             color = default_color
         else:
             color = ACTIVE
-        self.configure(background=color, activebackground=color)
+        repaint.configure(self, background=color, activebackground=color)
 
 
 # Audio
@@ -538,9 +806,9 @@ class Mute(Helper, Button):
         self.state = None  # True = Muted, False = unmuted (LIVE)
         self.input = input_
         super().__init__(frm, text=text, command=self.click, state='normal' if enabled else 'disabled', **kwargs)
-        if not cli_args.test:
-            self.obs_update(obsreq.get_input_mute(input_).input_muted)
-        obssubscribe(self.on_input_mute_state_changed)
+        key = f'input-muted-{input_}'
+        obs._request_key(key, 'GetInputMute', {'inputName': input_}, 'inputMuted')
+        obs._watch_init(key, self.obs_update)
     def click(self, state=None):
         """True = muted"""
         if state is None:
@@ -548,17 +816,14 @@ class Mute(Helper, Button):
         self.obs_update(state)  # update colors
         obsreq.set_input_mute(self.input, state)
     def obs_update(self, state):
+        if state is None:  # not known (the request failed)
+            return
         self.state = state
         if state: # mute on
-            self.configure(background=default_color, activebackground=default_color)
+            repaint.configure(self, background=default_color, activebackground=default_color)
         else:    # mute off
-            self.configure(background=ACTIVE, activebackground=ACTIVE)
+            repaint.configure(self, background=ACTIVE, activebackground=ACTIVE)
         indicators['live'].update_('mute-'+self.input, 'unmuted' if not state else None)
-    def on_input_mute_state_changed(self, data):
-        """Muting/unmuting"""
-        if data.input_name == self.input:
-            LOG.info("OBS: Mute %r to %r", data.input_name, data.input_muted)
-            self.obs_update(state=data.input_muted)
 class Volume(Helper, ttk.Frame):
     def __init__(self, frame, input_, **kwargs):
         self.input = input_
@@ -570,13 +835,11 @@ class Volume(Helper, ttk.Frame):
         self.label = ttk.Label(self, text="x");
         self.label.grid(row=0, column=5)
         self.columnconfigure(tuple(range(6)), weight=1)
-        # Initial update
-        if not cli_args.test:
-            dB = obsreq.get_input_volume(input_).input_volume_db
-            LOG.info("OBS: %r %r (volume_state)", input_, dB)
-            self.obs_update(dB)
-        # Callback update
-        obssubscribe(self.on_input_volume_changed)
+        self.set_volume_throttled = Throttle(self, self.set_volume, cli_args.max_update_rate)
+        # Initial and callback update
+        key = f'input-volume-{input_}'
+        obs._request_key(key, 'GetInputVolume', {'inputName': input_}, 'inputVolumeDb')
+        obs._watch_init(key, self.obs_update)
     def to_dB(self, state):
         return - 10**(-state) + 1
     def to_state(self, dB):
@@ -586,27 +849,35 @@ class Volume(Helper, ttk.Frame):
         state = float(state)
         dB = self.to_dB(state)
         #print(f'-> Setting volume: {state!r}     ->  {dB!r}')
-        self.label.config(text=f"{dB:.1f} dB")
+        repaint.configure(self.label, text=f"{dB:.1f} dB")
         self.last_dB = dB
+        self.set_volume_throttled(dB)
+    def set_volume(self, dB):
         obsreq.set_input_volume(self.input, vol_db=dB)
     def obs_update(self, dB):
         #print('<=')
+        if dB is None:  # not known (the request failed)
+            return
+        LOG.debug("OBS: %r %r (volume_state)", self.input, dB)
         state = self.to_state(dB)
         #print(f'<= Setting volume: {state!r}    <- {dB!r}')
-        self.label.config(text=f"{dB:.1f} dB")
-        self.value.set(state)
-    def on_input_volume_changed(self, data):
-        """Volume change callback"""
-        if data.input_name == self.input:
-            #print(f"OBS: Volume {data.input_name!r} to {data.input_volume_db!r}")
-            self.obs_update(data.input_volume_db)
+        repaint.configure(self.label, text=f"{dB:.1f} dB")
+        if self.value.get() != state:
+            self.value.set(state)
 
 
 
 # PIP
 class PipSize(Helper, ttk.Frame):
+    POLL_MIN = 1000   # ms, polling interval when the size changes
+    POLL_MAX = 16000  # ms, polling backs off up to this while it's stable
+    EVENT_WAIT = 2    # s, our own change should come back as an event in this time
     def __init__(self, frame, **kwargs):
         self.last_state = 0.25
+        self.pip_id = None
+        self.events_ok = False     # SceneItemTransformChanged events are arriving
+        self.expect_event = None   # time.monotonic() of our last change that hasn't come back
+        self.poll_interval = self.POLL_MIN
         super().__init__(frame, **kwargs)
         self.value = DoubleVar()
         self.scale = Scale(self, from_=0, to=1, orient=HORIZONTAL, command=self.update, showvalue=0, resolution=.01, variable=self.value)
@@ -615,27 +886,27 @@ class PipSize(Helper, ttk.Frame):
         self.label = ttk.Label(self, text="?")
         self.label.grid(row=0, column=5)
         self.columnconfigure(tuple(range(6)), weight=1)
-        # update polling
-        if not cli_args.test:
-            self.pip_id = obsreq.get_scene_item_id(NOTES, PIP).scene_item_id
-            obssubscribe(self.on_custom_event)
-            if not cli_args.no_pip_poll:
-                self.update_pip_size()
+        self.set_size_throttled = Throttle(self, self.set_size, cli_args.max_update_rate)
+        # update events, with polling as a fallback
+        obssubscribe([self.on_custom_event, self.on_scene_item_transform_changed])
+        then(scene_items.get(NOTES, PIP), self.set_pip_id)
+        if not cli_args.no_pip_poll:
+            self.update_pip_size()
     def update(self, state):
         """Update callback of slider"""
         state = float(state)
-        self.label.configure(text=f"{state:0.2f}")
+        repaint.configure(self.label, text=f"{state:0.2f}")
         if state == 0:   color = default_color
         else:            color = ACTIVE
         indicators['live'].update_('pip-size', 'visible' if state != 0 else None)
 
-        self.scale.configure(background=color, activebackground=color)
-        for scene in SCENES_WITH_PIP:
-            id_ = obsreq.get_scene_item_id(scene, PIP).scene_item_id
-            transform = obsreq.get_scene_item_transform(scene, id_).scene_item_transform
-            transform['scaleX'] = state
-            transform['scaleY'] = state
-            obsreq.set_scene_item_transform(scene, id_, transform)
+        repaint.configure(self.scale, background=color, activebackground=color)
+        self.set_size_throttled(state)
+    def set_size(self, state):
+        """Set the PIP size in OBS"""
+        set_pip_transform({'scaleX': state, 'scaleY': state})
+        if self.expect_event is None:
+            self.expect_event = time.monotonic()
     def save_last(self):
         """Save pip size for future restoring"""
         self.last_state = self.value.get()
@@ -647,11 +918,12 @@ class PipSize(Helper, ttk.Frame):
         self.update(self.last_state)
     def obs_update(self, state):
         """"Callabck for scale update from OBS"""
-        self.value.set(state)
-        self.label.configure(text=f"{state:0.2f}")
+        if self.value.get() != state:
+            self.value.set(state)
+        repaint.configure(self.label, text=f"{state:0.2f}")
         if state == 0:   color = default_color
         else:            color = ACTIVE
-        self.scale.configure(background=color, activebackground=color)
+        repaint.configure(self.scale, background=color, activebackground=color)
         indicators['live'].update_('pip-size', 'visible' if state != 0 else None)
     def on_custom_event(self, data):
         """Custom event listener callback from OBS."""
@@ -659,40 +931,154 @@ class PipSize(Helper, ttk.Frame):
         if hasattr(data, 'pip_last_state'):
             self.last_state = data.pip_last_state
             print(f"Saving last pip size: {self.last_state!r}")
+    def set_pip_id(self, id_):
+        self.pip_id = id_
+        return id_
+    def on_scene_item_transform_changed(self, data):
+        """Transform changes (the high-volume event, subscribed separately)"""
+        if data.scene_name != NOTES or data.scene_item_id != self.pip_id:
+            return
+        self.events_ok = True
+        self.expect_event = None
+        self.obs_update(data.scene_item_transform['scaleX'])
     def update_pip_size(self):
-        """The on_scene_item_transform_changed doesn't seem to work, so we have to poll here... unfortunately."""
-        self.obs_update(obsreq.get_scene_item_transform(NOTES, self.pip_id).scene_item_transform['scaleX'])
-        self.after(1000, self.update_pip_size)
+        """Poll the PIP size, in case the transform events don't arrive.
+
+        Once our own change has come back as an event, events are trusted
+        and nothing is requested.  If a change doesn't come back in
+        EVENT_WAIT seconds, we go back to polling.  While polling, the
+        interval doubles (up to POLL_MAX) each time the size is unchanged.
+        """
+        if self.expect_event is not None and time.monotonic() - self.expect_event > self.EVENT_WAIT:
+            LOG.info("PipSize: no transform events, polling")
+            self.events_ok = False
+            self.expect_event = None
+            self.poll_interval = self.POLL_MIN
+        if self.events_ok:
+            self.after(self.POLL_MIN, self.update_pip_size)
+            return
+        def done(state):
+            if state == self.value.get():
+                self.poll_interval = min(self.poll_interval * 2, self.POLL_MAX)
+            else:
+                self.poll_interval = self.POLL_MIN
+            self.obs_update(state)
+            self.after(self.poll_interval, self.update_pip_size)
+        dispatch.on_result(self.get_size(), done,
+                           errback=lambda exc: self.after(self.POLL_MIN, self.update_pip_size))
+    def get_size(self):
+        """Return a future of the current PIP size in OBS"""
+        transform = then(then(scene_items.get(NOTES, PIP), self.set_pip_id),
+                         lambda id_: obsreq.get_scene_item_transform(NOTES, id_))
+        return then(transform, lambda data: data.scene_item_transform['scaleX'])
+    def resync(self):
+        """After reconnecting: fetch the size, and don't trust events until seen again"""
+        self.events_ok = False
+        self.expect_event = None
+        self.poll_interval = self.POLL_MIN
+        def done(state):
+            if state != self.value.get():
+                self.obs_update(state)
+        dispatch.on_result(self.get_size(), done)
+
+class SceneItemIndex:
+    """Scene item IDs of all scenes, kept in memory.
+
+    The item lists of all scenes are fetched in one request batch, and
+    (scene, source) → scene item ID lookups are answered from that.  Any
+    event that could change the IDs drops the index, and it is fetched
+    again on the next lookup.
+    """
+    _LOG = logging.getLogger('SceneItemIndex')
+    def __init__(self, scenes):
+        self.scenes = list(scenes)
+        self._future = None  # future of {(scene, source): id}
+        self._lock = threading.Lock()
+        obssubscribe([self.on_scene_item_created, self.on_scene_item_removed,
+                      self.on_scene_list_changed])
+    def load(self):
+        """Return a future of the {(scene, source): id} dict (fetching it if needed)."""
+        with self._lock:
+            if self._future is None:
+                self._LOG.debug('Fetching scene items of %r', self.scenes)
+                batch = obsreq.send_batch([('GetSceneItemList', {'sceneName': scene})
+                                           for scene in self.scenes], raw=True)
+                self._future = then(batch, self._index)
+                self._future.add_done_callback(self._check_failed)
+            return self._future
+    def _index(self, results):
+        ids = { }
+        for scene, data in zip(self.scenes, results or [ ]):
+            for item in (data or { }).get('sceneItems', [ ]):
+                ids[scene, item['sourceName']] = item['sceneItemId']
+        return ids
+    def _check_failed(self, future):
+        if future.exception() is not None:
+            self.invalidate(future)
+    def get(self, scene, source):
+        """Return a future of the scene item ID of source in scene (None if not there)"""
+        return then(self.load(), lambda ids: ids.get((scene, source)))
+    def invalidate(self, future=None):
+        """Drop the index (only if it is still `future`, if given)"""
+        with self._lock:
+            if future is None or self._future is future:
+                self._LOG.debug('Invalidating')
+                self._future = None
+    def on_scene_item_created(self, data):
+        self.invalidate()
+    def on_scene_item_removed(self, data):
+        self.invalidate()
+    def on_scene_list_changed(self, data):
+        self.invalidate()
+
+def set_pip_transform(transform):
+    """Set these transform fields of the PIP in all scenes, in one request batch.
+
+    OBS only changes the given fields, so the old transform doesn't need
+    to be read first, and all scenes change at once.
+    """
+    def send(ids):
+        return obsreq.send_batch([('SetSceneItemTransform', {'sceneName': scene,
+                                                             'sceneItemId': ids[scene, PIP],
+                                                             'sceneItemTransform': transform})
+                                  for scene in SCENES_WITH_PIP if (scene, PIP) in ids])
+    then(scene_items.load(), send)
 
 # PIP crop selection
 def pip_crop(n):
     print(f"PIP crop → {n} people")
-
-    for scene in SCENES_WITH_PIP:  # TODO: with gallery
-        id_ = obsreq.get_scene_item_id(scene, PIP).scene_item_id
-        transform = obsreq.get_scene_item_transform(scene, id_).scene_item_transform
-        #print('====old', transform)
-        for (k,v) in PIP_CROP_FACTORS[n].items():
-            transform['crop'+k.title()] = v
-        #print('====new:', transform)
-        obsreq.set_scene_item_transform(scene, id_, transform)
+    # TODO: with gallery
+    set_pip_transform({'crop'+k.title(): v for (k,v) in PIP_CROP_FACTORS[n].items()})
 
 # Playback
 class PlaybackTimer(Helper, ttk.Label):
+    """Countdown of the media playing in input_name.
+
+    The status is fetched once when playback starts, then counted down
+    locally with time.monotonic().  It is fetched again only on media
+    events (pause, stop, restart, ...) and every RESYNC ms as a check.
+    """
+    TICK = 200      # ms, local countdown update
+    RESYNC = 10000  # ms
     def __init__(self, frm, input_name, *args, **kwargs):
         self.input_name = input_name
+        self.sync_id = 0  # Incremented on each sync, to stop the old tick/resync loops
         super().__init__(frm, *args, **kwargs)
-        self.configure(text='-')
-        obssubscribe(self.on_media_input_playback_started)
+        repaint.configure(self, text='-')
+        obssubscribe([self.on_media_input_playback_started,
+                      self.on_media_input_playback_ended,
+                      self.on_media_input_action_triggered])
     def update_timer(self):
-        event = obsreq.get_media_input_status(self.input_name)
+        dispatch.on_result(obsreq.get_media_input_status(self.input_name), self.show_status)
+    def show_status(self, event):
+        self.sync_id += 1
         state = event.media_state  # 'OBS_MEDIA_STATE_PAUSED', 'OBS_MEDIA_STATE_PLAYING'
-        if state in {'OBS_MEDIA_STATE_OPENING', 'OBS_MEDIA_STATE_BUFFERING', 'OBS_MEDIA_STATE_PAUSED', }:
+        if state in {'OBS_MEDIA_STATE_OPENING', 'OBS_MEDIA_STATE_BUFFERING', }:
             print(f"OBS media state: {state!r}")
             self.after(500, self.update_timer)
             return
-        if state != 'OBS_MEDIA_STATE_PLAYING':
-            self.configure(text='-', background=default_color)
+        if state not in {'OBS_MEDIA_STATE_PLAYING', 'OBS_MEDIA_STATE_PAUSED'}:
+            repaint.configure(self, text='-', background=default_color)
             print(f"OBS media state: {state!r}")
             return
         duration = event.media_duration
@@ -700,15 +1086,42 @@ class PlaybackTimer(Helper, ttk.Label):
         if duration < 0:
             self.after(500, self.update_timer)
             return
+        self.after(self.RESYNC, self.resync, self.sync_id)
+        if state == 'OBS_MEDIA_STATE_PAUSED':
+            print(f"OBS media state: {state!r}")
+            self.show(duration, cursor)
+            return
+        self.tick(self.sync_id, duration, cursor, time.monotonic())
+    def tick(self, sync_id, duration, cursor, synced_at):
+        """Local countdown from the last synced cursor"""
+        if sync_id != self.sync_id:
+            return
+        now = cursor + int((time.monotonic() - synced_at) * 1000)
+        if now >= duration:
+            self.update_timer()
+            return
+        self.show(duration, now)
+        self.after(self.TICK, self.tick, sync_id, duration, cursor, synced_at)
+    def resync(self, sync_id):
+        if sync_id == self.sync_id:
+            self.update_timer()
+    def show(self, duration, cursor):
         def s_to_mmss(s):
             return f'{s//60}:{s%60:02}'
-        self.configure(text=f'-{s_to_mmss((duration-cursor)//1000)}/{s_to_mmss(duration//1000)}',
-                       background=ACTIVE)
-        self.after(500, self.update_timer)
+        repaint.configure(self, text=f'-{s_to_mmss((duration-cursor)//1000)}/{s_to_mmss(duration//1000)}',
+                          background=ACTIVE)
     def on_media_input_playback_started(self, data):
         """Playing media"""
-        print("OBS: media playback started")
-        self.update_timer()
+        if data.input_name == self.input_name:
+            print("OBS: media playback started")
+            self.update_timer()
+    def on_media_input_playback_ended(self, data):
+        if data.input_name == self.input_name:
+            self.update_timer()
+    def on_media_input_action_triggered(self, data):
+        """Pause, play, restart, stop, ..."""
+        if data.input_name == self.input_name:
+            self.update_timer()
 class PlayFile(Helper, ttk.Button):
     def __init__(self, frm, filename, label, **kwargs):
         self.filename = filename
@@ -903,11 +1316,8 @@ class Preset():
             color = ACTIVE
         else:
             color = default_color
-        if self.sbox_value.get() == '-':
-            self.button['state'] = 'disabled'
-        else:
-            self.button['state'] = 'normal'
-        self.button.configure(background=color, activebackground=color)
+        repaint.configure(self.button, background=color, activebackground=color,
+                          state='disabled' if self.sbox_value.get() == '-' else 'normal')
 
     def rename(self):
         dialog = Toplevel()
@@ -1009,9 +1419,85 @@ class QuickBackGo(Helper, ttk.Button):
 
 
 
-def main():
+#
+# Debugging
+#
+class StatsWindow:
+    """--stats: a window of the request and event metrics, updated every second."""
+    INTERVAL = 1000  # ms
+    COLUMNS = [('count', 'Count'), ('rate', '/s'), ('errors', 'Errors'), ('timeouts', 'Timeouts'),
+               ('p50', 'p50 ms'), ('p90', 'p90 ms'), ('p99', 'p99 ms')]
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.last = None  # previous snapshot, for the rates
+        self.window = Toplevel(root)
+        self.window.wm_title("OBS request statistics")
+        self.tree = ttk.Treeview(self.window, columns=[c for c, _ in self.COLUMNS], height=25)
+        self.tree.heading('#0', text='Request / event')
+        self.tree.column('#0', width=260)
+        for column, heading in self.COLUMNS:
+            self.tree.heading(column, text=heading)
+            self.tree.column(column, width=70, anchor=E)
+        self.tree.grid(row=0, column=0, sticky=NSEW)
+        self.summary = ttk.Label(self.window, justify=LEFT)
+        self.summary.grid(row=1, column=0, sticky=W)
+        self.window.columnconfigure(0, weight=1)
+        self.window.rowconfigure(0, weight=1)
+        self.tree.insert('', END, 'requests', text='Requests', open=True)
+        self.tree.insert('', END, 'batched', text='In request batches', open=True)
+        self.tree.insert('', END, 'events', text='Events', open=True)
+        self.update_()
+    def _row(self, parent, name, values):
+        iid = f'{parent}-{name}'
+        if not self.tree.exists(iid):
+            self.tree.insert(parent, END, iid, text=name)
+        self.tree.item(iid, values=values)
+    def update_(self):
+        if not self.window.winfo_exists():
+            return
+        s = self.metrics.snapshot()
+        def rate(section, name):
+            if self.last is None:
+                return ''
+            return f"{(s[section].get(name, 0) - self.last[section].get(name, 0)) * 1000 / self.INTERVAL:.1f}"
+        def ms(hist, q):
+            value = hist.quantile(q) if hist is not None else None
+            return '' if value is None else f'{value*1000:.1f}'
+        for name, count in s['requests'].items():
+            hist = s['latency'].get(name)
+            self._row('requests', name, [count, rate('requests', name), s['errors'].get(name, 0),
+                                         s['timeouts'].get(name, 0), ms(hist, .5), ms(hist, .9), ms(hist, .99)])
+        for name, count in s['batched'].items():
+            self._row('batched', name, [count, rate('batched', name)])
+        for name, count in s['events'].items():
+            self._row('events', name, [count, rate('events', name)])
+        self.summary.configure(text=(
+            f"In flight: {s['in_flight']}    Reconnects: {s['reconnects']}    Uptime: {s['uptime']:.0f} s\n"
+            f"Event dispatch delay p50/p99: {ms(s['dispatch_delay'], .5)}/{ms(s['dispatch_delay'], .99)} ms    "
+            f"Event handlers p50/p99: {ms(s['handler_time'], .5)}/{ms(s['handler_time'], .99)} ms"))
+        self.last = s
+        self.window.after(self.INTERVAL, self.update_)
+
+def write_metrics(metrics, filename, interval):
+    """--metrics-file: write the metrics in the Prometheus text format every interval s"""
+    try:
+        metrics.write_prometheus(filename)
+    except OSError as e:
+        LOG.error('Could not write metrics to %s: %s', filename, e)
+    root.after(int(interval * 1000), write_metrics, metrics, filename, interval)
+
+
+
+
+def main(argv=None, mainloop=True):
+    """Run the control panel.
+
+    With mainloop=False, return once the panel is set up, without running
+    the Tk main loop (used by the benchmarks).
+    """
     # pylint: disable=unused-variable
     global cli_args
+    startup = PhaseTimer()
 
     parser = argparse.ArgumentParser()
     parser.add_argument('hostname_port',
@@ -1022,15 +1508,27 @@ def main():
                         help="window name regex for notes document (for scrolling), get via xwininfo -tree -root | less.  Example: '^Collaborative document.*Privat()e' (the parentheses prevent the regex from matching itself in the process listing)")
     parser.add_argument('--small', action='store_true',
                         help="Start a smaller, more limited, control panel for instructors.")
-    parser.add_argument('--test', action='store_true', help="Don't connect to OBS, just show the panel in a test mode.  Some things may not work.")
+    parser.add_argument('--test', action='store_true', help="Don't connect to OBS, but to a mock OBS started in this process (see obs_cr/mockobs.py).")
+    parser.add_argument('--test-latency', type=float, default=0,
+                        help="With --test, delay every response and event of the mock OBS by this many ms (default %(default)s)")
     parser.add_argument('--scene-hook', action=DictAction, nargs=1,
                         help="Local command line hooks for switching to each scene, format SCENENAME=command")
     parser.add_argument('--resolution-command',
                         help="Command to run when setting resolution.  WIDTH and HEIGHT will be replaced with integers.  Example: \"xdotool search --onlyvisible --name '^Zoom$' windowsize WIDTH HEIGHT;\" (mind the nested quotes)")
     parser.add_argument('--no-pip-poll', action='store_true', help="Don't poll for pip size (for less verbosity when testing)")
+    parser.add_argument('--max-update-rate', type=float, default=10,
+                        help="Maximum updates per second sent to OBS while dragging a slider (default %(default)s)")
     parser.add_argument('--broadcaster', action='store_true', help="This is running on broadcaster's computer.  Enable extra broadcaster functionality like unmuting and controlling Zoom.")
+    parser.add_argument('--stats', action='store_true',
+                        help="Open a window with statistics of the requests to and events from OBS.")
+    parser.add_argument('--metrics-file',
+                        help="Write the request and event statistics to this file in the Prometheus text format (e.g. for the node exporter's textfile collector).")
+    parser.add_argument('--metrics-interval', type=float, default=15,
+                        help="Write --metrics-file this often, in seconds (default %(default)s)")
     parser.add_argument('--verbose', '-v', action='count', default=0)
-    args = cli_args = parser.parse_args()
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="Print how long each phase of the startup takes.")
+    args = cli_args = parser.parse_args(argv)
     if args.verbose >= 3:
         logging.basicConfig(level=9)
     elif args.verbose >= 2:
@@ -1040,39 +1538,78 @@ def main():
         logging.basicConfig(level=logging.INFO)
         logging.getLogger('obsws_python').setLevel(logging.INFO)
     LOG.debug("Arguments: %s", cli_args)
+    startup.mark('arguments')
 
 
     # OBS websocket
     global obs
     global obsreq
     global obssubscribe
-    if not cli_args.test:
-        hostname = cli_args.hostname_port.split(':')[0]
-        port = cli_args.hostname_port.split(':')[1]
-        password = cli_args.password
-
-        import obsws_python
-        obsreq = obsws_python.ReqClient(host=hostname, port=port, password=password, timeout=3)
-        cl = obsws_python.EventClient(host=hostname, port=port, password=password, timeout=3)
-        obssubscribe = cl.callback.register
-    else:
-        class Request():
-            def __call(self, _method, *args, **kwargs):
-                print(f'[test] OBS request: {_method}({args}, {kwargs})')
-            def __getattr__(self, name):
-                return partial(self.__call, name)
-        obsreq = Request()
-        obssubscribe = getattr(obsreq, 'callback.register')
-        cl = type('null', (), {'callback':type('null', (), {'register': lambda *args, **kwargs: None})})
+    global dispatch
+    hostname = cli_args.hostname_port.split(':')[0]
+    port = cli_args.hostname_port.split(':')[1]
+    password = cli_args.password
+    if cli_args.test:
+        # A pretend OBS in this process, with our scenes and inputs
+        from . import mockobs
+        mock = mockobs.start(scenes=list(SCENE_NAMES), pip_scenes=SCENES_WITH_PIP,
+                             audio_inputs=[AUDIO_INPUT, AUDIO_INPUT_BRCD], media_inputs=[PLAYBACK_INPUT],
+                             latency=cli_args.test_latency/1000)
+        hostname, port = mock.server_address
+        password = None
+        print(f'[test] Using a mock OBS on {hostname}:{port}')
+
+    metrics = None
+    if cli_args.stats or cli_args.metrics_file:
+        from .metrics import Metrics
+        metrics = Metrics()
+
+    # Connect (and import obsws_python) in the background while Tk
+    # starts.  Nothing is subscribed to until handlers are registered
+    # below, so there are no events before `call` is set.
+    connected = { }
+    def connect():
+        try:
+            from . import connection
+            connected['import'] = time.perf_counter()
+            # One connection for both requests and events.  It subscribes
+            # only to the events that get handlers registered below.
+            connected['cl'] = connection.Supervisor(
+                host=hostname, port=port, password=password, timeout=3, metrics=metrics)
+        except Exception as e:  # pylint: disable=broad-except
+            connected['error'] = e
+        connected['done'] = time.perf_counter()
+    connect_thread = threading.Thread(target=connect, name='connect', daemon=True)
+    connect_thread.start()
+
+    init_tk()
+    dispatch = TkDispatcher(root)
+    root.title("OBS CodeRefinery control")
+    connecting = ttk.Label(root, text=f"Connecting to OBS at {hostname}:{port} ...", padding=20)
+    connecting.pack()
+    root.update()
+    startup.mark('tk')
+
+    connect_thread.join()
+    if 'error' in connected:
+        raise connected['error']
+    cl = connected['cl']
+    cl.call = dispatch.call  # Event handlers run in the Tk thread
+    startup.mark('connect (waiting)', f"import {(connected['import']-startup.start)*1000:.0f} ms, "
+                                      f"ready {(connected['done']-startup.start)*1000:.0f} ms after start")
+    connecting.destroy()
+    obsreq = cl.req
+    obssubscribe = cl.callback.register
 
     obs = ObsState(obsreq, cl)
+    global scene_items
+    scene_items = SceneItemIndex(SCENE_NAMES)
+    scene_items.load()
 
 
     #
     # GUI setup
     #
-    #root = Tk()
-    root.title("OBS CodeRefinery control")
     frm = ttk.Frame(root)
     frm.columnconfigure(tuple(range(10)), weight=1)
     frm.rowconfigure(tuple(range(10)), weight=1)
@@ -1111,16 +1648,7 @@ def main():
     indicator_frame.columnconfigure(tuple(range(10)), weight=1)
     indicators = { }
     indicators['live'] = IndicatorMasterLive(indicator_frame, 'indicator-live', label="Live", color='red', grid=g(0,0), grid_s=g(0,0), tooltip="Master live warning.  RED if anything is live on stream (tooltip will indicate what is on).")
-    for i, (name, label, color, tt, kwargs) in enumerate([
-        ('warning',  'Warn',     'red',    'Master warning: some urgent issue, please check.', {'blink': 500}),
-        ('caution',  'Caution',  'yellow', 'Master caution: some issue, please check.', {}),
-        ('time',     'Time',     'yellow', 'General "check time" indicator.', {}),
-        ('notes',    'Notes',    'cyan',   'General "check shared notes" indicator.', {}),
-        ('question', 'Question', 'cyan',   'Important question, check chat or notes', {}),
-        ('chat',     'Chat',     'cyan',   'Check chat indicator', {}),
-        ('slower',     '<',      'yellow', 'Slower', {}),
-        ('faster',     '>',      'yellow', 'Faster', {}),
-        ]):
+    for i, (name, label, color, tt, kwargs) in enumerate(INDICATORS):
         indicators[name] = IndicatorLight(indicator_frame, 'indicator-'+name, label, color=color,
                                           grid  =g(row=0, column=i+1),
                                           grid_s=g(row=0, column=i+1),
@@ -1248,12 +1776,8 @@ def main():
     f_presets.columnconfigure((0,1,2,5,6,7), weight=15)
     f_presets.columnconfigure((3,8), weight=5)
     f_presets.columnconfigure((4), minsize=20)
-    preset_a = Preset(f_presets, 'preset-a', "A", row=0, column=0)
-    preset_b = Preset(f_presets, 'preset-b', "B", row=0, column=5)
-    preset_c = Preset(f_presets, 'preset-c', "C", row=1, column=0)
-    preset_d = Preset(f_presets, 'preset-d', "D", row=1, column=5)
-    preset_e = Preset(f_presets, 'preset-e', "E", row=2, column=0)
-    preset_f = Preset(f_presets, 'preset-f', "F", row=2, column=5)
+    for i, (name, label) in enumerate(PRESETS):
+        Preset(f_presets, name, label, row=i//2, column=0 if i%2 == 0 else 5)
 
     qbs = QuickBackSelect(frm, name='quickback-a', grid=g(row=1, column=4))
     qbg = QuickBackGo(frm, qbs, grid=g(row=1, column=3), grid_s=g(row=1, column=2))
@@ -1265,7 +1789,37 @@ def main():
         obs._watch('notes_scroll', notes_scroll)
 
 
+    startup.mark('widgets')
+    # Show the panel, then fill in the initial values of everything
+    # that was set up above
+    root.update()
+    startup.mark('first paint')
+    def tooltips():
+        attach_tooltips()
+        startup.mark('tooltips (after showing)')
+        if cli_args.profile_startup:
+            startup.report()
+    def hydrated():
+        startup.mark('initial values')
+        root.after_idle(tooltips)
+    obs._hydrate(then=hydrated)
+
+    # After reconnecting, fetch everything that may have changed meanwhile
+    def reconnected():
+        scene_items.invalidate()
+        obs._resync()
+        pip_size.resync()
+        playback.update_timer()
+    cl.on_reconnect.append(partial(dispatch.call, reconnected))
+
+    if cli_args.stats:
+        StatsWindow(metrics)
+    if cli_args.metrics_file:
+        write_metrics(metrics, cli_args.metrics_file, cli_args.metrics_interval)
+
     # begin
+    if not mainloop:
+        return
     print('starting...')
     root.mainloop()
 
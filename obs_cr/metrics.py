@@ -0,0 +1,172 @@
+"""Counters and latency histograms of the traffic with OBS.
+
+A Metrics object is given to the connection.Supervisor, which then
+records every request (count, latency, errors and timeouts, by request
+type) and every event (count, how long it waited to be dispatched and
+how long its handlers took).  snapshot() gives the numbers for the
+control panel's --stats window, and prometheus() in the Prometheus text
+format for --metrics-file.
+"""
+
+import bisect
+import collections
+import os
+import threading
+import time
+
+from obsws_python.error import OBSSDKTimeoutError
+
+# Histogram bucket upper bounds, s
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+
+class Histogram:
+    """Counts of values in BUCKETS (not cumulative, the last is +Inf)"""
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated within the bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                low = BUCKETS[i-1] if i > 0 else 0
+                high = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return low + (high - low) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+    def copy(self):
+        new = Histogram()
+        new.counts, new.sum, new.count = list(self.counts), self.sum, self.count
+        return new
+
+
+
+class Metrics:
+    """Request and event metrics.  All methods are thread-safe."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.requests = collections.Counter()   # requestType (or RequestBatch): count
+        self.batched = collections.Counter()    # requestType: count within batches
+        self.errors = collections.Counter()     # requestType: failed, other than timeouts
+        self.timeouts = collections.Counter()   # requestType: timed out
+        self.latency = collections.defaultdict(Histogram)  # requestType: Histogram
+        self.events = collections.Counter()     # eventType: count
+        self.dispatch_delay = Histogram()       # event received -> handlers start
+        self.handler_time = Histogram()         # time in the event handlers
+        self.reconnects = 0
+        self.in_flight = 0
+
+    def request(self, request_type, future, batched=()):
+        """Record a request whose response is the future.
+
+        For a request batch, request_type is 'RequestBatch' and batched
+        are the types of the requests in it.
+        """
+        start = time.monotonic()
+        with self._lock:
+            self.requests[request_type] += 1
+            self.batched.update(batched)
+            self.in_flight += 1
+        def done(future):
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.in_flight -= 1
+                self.latency[request_type].observe(elapsed)
+                if isinstance(future.exception(), OBSSDKTimeoutError):
+                    self.timeouts[request_type] += 1
+                elif future.exception() is not None:
+                    self.errors[request_type] += 1
+        future.add_done_callback(done)
+        return future
+
+    def event(self, event_type, received, started, finished):
+        """Record an event, with the time.monotonic() when it was received,
+        when its handlers started and when they finished."""
+        with self._lock:
+            self.events[event_type] += 1
+            self.dispatch_delay.observe(started - received)
+            self.handler_time.observe(finished - started)
+
+    def reconnected(self):
+        with self._lock:
+            self.reconnects += 1
+
+    def snapshot(self):
+        """A consistent copy of all the numbers, as a dict"""
+        with self._lock:
+            return {
+                'uptime': time.monotonic() - self.started,
+                'requests': dict(self.requests),
+                'batched': dict(self.batched),
+                'errors': dict(self.errors),
+                'timeouts': dict(self.timeouts),
+                'latency': {name: h.copy() for name, h in self.latency.items()},
+                'events': dict(self.events),
+                'dispatch_delay': self.dispatch_delay.copy(),
+                'handler_time': self.handler_time.copy(),
+                'reconnects': self.reconnects,
+                'in_flight': self.in_flight,
+                }
+
+    def prometheus(self, prefix='obs_cr'):
+        """All metrics in the Prometheus text exposition format"""
+        s = self.snapshot()
+        lines = [ ]
+        def metric(name, kind, help_, samples):
+            lines.append(f'# HELP {prefix}_{name} {help_}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            for suffix, labels, value in samples:
+                label_str = ','.join(f'{k}="{v}"' for k, v in labels.items())
+                # All digits: rounded counters would stop increasing
+                value = repr(value) if isinstance(value, float) else str(value)
+                lines.append(f'{prefix}_{name}{suffix}{{{label_str}}} {value}' if label_str
+                             else f'{prefix}_{name}{suffix} {value}')
+        def histogram(hist, labels):
+            samples = [ ]
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ('+Inf',), hist.counts):
+                cumulative += n
+                samples.append(('_bucket', dict(labels, le=bound), cumulative))
+            samples.append(('_sum', labels, hist.sum))
+            samples.append(('_count', labels, hist.count))
+            return samples
+        metric('requests_total', 'counter', 'Request messages sent to OBS (batches as RequestBatch)',
+               [('', {'request': k}, v) for k, v in sorted(s['requests'].items())])
+        metric('batched_requests_total', 'counter', 'Requests sent to OBS within request batches',
+               [('', {'request': k}, v) for k, v in sorted(s['batched'].items())])
+        metric('request_errors_total', 'counter', 'Requests that failed, by kind',
+               [('', {'request': k, 'kind': 'error'}, v) for k, v in sorted(s['errors'].items())]
+               + [('', {'request': k, 'kind': 'timeout'}, v) for k, v in sorted(s['timeouts'].items())])
+        metric('request_duration_seconds', 'histogram', 'Time from sending a request to its response',
+               [x for k, h in sorted(s['latency'].items()) for x in histogram(h, {'request': k})])
+        metric('requests_in_flight', 'gauge', 'Requests waiting for a response', [('', { }, s['in_flight'])])
+        metric('events_total', 'counter', 'Events received from OBS',
+               [('', {'event': k}, v) for k, v in sorted(s['events'].items())])
+        metric('event_dispatch_delay_seconds', 'histogram', 'Time from receiving an event to running its handlers',
+               histogram(s['dispatch_delay'], { }))
+        metric('event_handler_seconds', 'histogram', 'Time spent in the event handlers',
+               histogram(s['handler_time'], { }))
+        metric('reconnects_total', 'counter', 'Reconnections to OBS', [('', { }, s['reconnects'])])
+        metric('uptime_seconds', 'gauge', 'Time since start', [('', { }, s['uptime'])])
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename):
+        """Write prometheus() to filename, atomically (for the node exporter textfile collector)"""
+        tmp = f'{filename}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(tmp, filename)
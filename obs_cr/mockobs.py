@@ -0,0 +1,513 @@
+"""A pretend OBS, for running and measuring the panels without one.
+
+MockObs is an obs-websocket v5 server (see wsserver.py) that keeps a
+small model of OBS in memory: scenes with scene items and their
+transforms, audio inputs with mute and volume, media inputs that "play"
+for a while, persistent data, custom events and screenshots (drawn from
+the scene, so they change when the PIP does).  Every message to the
+clients can be delayed by `latency` plus a random `jitter`, to see how
+things behave over a slow network.  As over TCP, the messages to each
+client still arrive in order.  `stats` counts the requests by type.
+
+    obs-cr-mock --listen 127.0.0.1:4455 --latency 50 --jitter 20
+    obs-cr-control 127.0.0.1:4455 -
+
+`obs-cr-control --test` runs one of these in-process.  Only the requests
+that the panels use (and a few more) are implemented.
+"""
+
+import base64
+import collections
+import hashlib
+import heapq
+import io
+import itertools
+import logging
+import math
+import random
+import struct
+import threading
+import time
+import uuid
+import zlib
+
+from . import wsserver
+from .wsserver import response
+
+LOG = logging.getLogger(__name__)
+
+# Like the scene collection that control.py expects
+SCENES = ['Title', 'Gallery', 'Screenshare', 'ScreenshareCrop', 'ScreenshareLandscape',
+          'Broadcaster-Screen', 'Notes', 'Empty']
+SCENES_WITH_PIP = ['Screenshare', 'ScreenshareCrop', 'ScreenshareLandscape', 'Broadcaster-Screen', 'Notes']
+PIP = '_GalleryCapture[hidden]'
+AUDIO_INPUTS = ['Instructors', 'BroadcasterMic']
+MEDIA_INPUTS = ['CRaudio']
+CANVAS = (840, 1080)
+MEDIA_DURATION = 5000  # ms, of any file that is "played"
+
+# Event subscription bits (obsws_python.Subs), without importing it
+GENERAL, SCENES_SUB, INPUTS, SCENEITEMS, MEDIAINPUTS = 1, 4, 8, 128, 256
+SCENEITEMTRANSFORMCHANGED = 1 << 19
+
+
+class RequestFailed(Exception):
+    """Fail a request with an obs-websocket status code"""
+    def __init__(self, code, comment):
+        super().__init__(comment)
+        self.code = code
+        self.comment = comment
+
+
+
+class _Scheduler:
+    """Run functions after a delay, in order, in one thread."""
+    def __init__(self):
+        self._queue = [ ]
+        self._ids = itertools.count()
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True, name='mockobs-scheduler').start()
+
+    def later(self, delay, func, *args):
+        self.at(time.monotonic() + delay, func, *args)
+
+    def at(self, when, func, *args):
+        """Run func(*args) at time.monotonic() `when`"""
+        with self._cond:
+            heapq.heappush(self._queue, (when, next(self._ids), func, args))
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    self._cond.wait(self._queue[0][0] - time.monotonic() if self._queue else None)
+                _, _, func, args = heapq.heappop(self._queue)
+            try:
+                func(*args)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception('Exception in %s', func)
+
+
+
+def _transform(source_width, source_height, **kwargs):
+    transform = {
+        'positionX': 0.0, 'positionY': 0.0, 'rotation': 0.0, 'scaleX': 1.0, 'scaleY': 1.0,
+        'alignment': 5, 'boundsType': 'OBS_BOUNDS_NONE', 'boundsAlignment': 0,
+        'boundsWidth': 0.0, 'boundsHeight': 0.0,
+        'cropTop': 0, 'cropBottom': 0, 'cropLeft': 0, 'cropRight': 0,
+        'sourceWidth': float(source_width), 'sourceHeight': float(source_height),
+        }
+    transform.update(kwargs)
+    return transform
+
+def _color(name):
+    """A stable, dark-ish color for each name"""
+    digest = hashlib.md5(name.encode()).digest()
+    return tuple(40 + b % 120 for b in digest[:3])
+
+def _png(width, height, rects):
+    """Encode a PNG of (x0, y0, x1, y1, color) rectangles, drawn in order."""
+    rows = { }
+    out = [ ]
+    for y in range(height):
+        spans = tuple((max(0, x0), min(width, x1), color) for (x0, y0, x1, y1, color) in rects
+                      if y0 <= y < y1 and x0 < x1)
+        if spans not in rows:
+            row = bytearray(3 * width)
+            for x0, x1, color in spans:
+                row[3*x0:3*x1] = bytes(color) * (x1 - x0)
+            rows[spans] = b'\0' + bytes(row)
+        out.append(rows[spans])
+    def chunk(kind, data):
+        return struct.pack('!I', len(data)) + kind + data + struct.pack('!I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('!IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b''.join(out), 1))
+            + chunk(b'IEND', b''))
+
+
+
+class MockObs(wsserver.ObsWsServer):
+    """obs-websocket server with a pretend OBS behind it."""
+    OBS_WEBSOCKET_VERSION = '5.0.0-mock'
+    def __init__(self, address, password=None, latency=0, jitter=0, scenes=SCENES,
+                 pip_scenes=SCENES_WITH_PIP, audio_inputs=AUDIO_INPUTS, media_inputs=MEDIA_INPUTS):
+        super().__init__(address, password=password)
+        self.latency = latency  # s
+        self.jitter = jitter    # s
+        self.stats = collections.Counter()
+        self._scheduler = _Scheduler()
+        self._delivery = { }  # session: time.monotonic() of its last scheduled message
+        self._delivery_lock = threading.Lock()
+        self._state_lock = threading.RLock()
+        self._item_ids = itertools.count(1)
+        self.scenes = { }  # name: {'uuid', 'items': [item, ...]}
+        for name in scenes:
+            items = [self._item(f'{name}Source', *CANVAS)]
+            if name in pip_scenes:
+                items.append(self._item(PIP, 1920, 1080, scaleX=0.25, scaleY=0.25,
+                                        positionX=CANVAS[0], positionY=CANVAS[1],
+                                        alignment=10))  # bottom right
+            self.scenes[name] = {'uuid': str(uuid.uuid4()), 'items': items}
+        self.program_scene = self.preview_scene = scenes[0]
+        self.inputs = { }  # name: {'kind', 'muted', 'volume_mul', 'settings', 'media'}
+        for name in audio_inputs:
+            self.inputs[name] = {'kind': 'pulse_input_capture', 'muted': True, 'volume_mul': 1.0,
+                                 'settings': { }, 'media': None}
+        for name in media_inputs:
+            self.inputs[name] = {'kind': 'ffmpeg_source', 'muted': False, 'volume_mul': 1.0,
+                                 'settings': { }, 'media': {'state': 'OBS_MEDIA_STATE_NONE',
+                                                            'cursor': 0, 'started': None, 'id': 0}}
+        self.persistent = { }  # (realm, slotName): value
+
+    def _item(self, source, width, height, **transform):
+        return {'sceneItemId': next(self._item_ids), 'sourceName': source, 'sceneItemEnabled': True,
+                'sceneItemLocked': False, 'sceneItemTransform': _transform(width, height, **transform)}
+
+    # Sending, with the simulated latency
+    def _delay(self):
+        return max(0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def _later(self, session, func, *args):
+        """Run func(*args) after the latency, but not before the earlier messages to session"""
+        with self._delivery_lock:
+            when = max(self._delivery.get(session, 0), time.monotonic() + self._delay())
+            self._delivery[session] = when
+        self._scheduler.at(when, func, *args)
+
+    def _reply(self, session, op, result):
+        self._later(session, super()._reply, session, op, result)
+
+    def broadcast(self, event_type, intent, data=None):
+        with self._lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            self._later(session, session.event, event_type, intent, data)
+
+    def closed(self, session):
+        with self._delivery_lock:
+            self._delivery.pop(session, None)
+
+    # Requests
+    def request(self, session, d):
+        request_type = d['requestType']
+        self.stats[request_type] += 1
+        handler = getattr(self, 'do_' + request_type, None)
+        if handler is None:
+            return super().request(session, d)
+        try:
+            with self._state_lock:
+                data = handler(d.get('requestData') or { })
+        except RequestFailed as e:
+            return response(d, result=False, code=e.code, comment=e.comment)
+        except KeyError as e:
+            return response(d, result=False, code=300, comment=f'Missing field {e}')  # MissingRequestField
+        return response(d, data)
+
+    def _scene(self, data, field='sceneName'):
+        if data[field] not in self.scenes:
+            raise RequestFailed(600, f'No source was found by the name of `{data[field]}`.')  # ResourceNotFound
+        return self.scenes[data[field]]
+
+    def _scene_item(self, data):
+        for item in self._scene(data)['items']:
+            if item['sceneItemId'] == data['sceneItemId']:
+                return item
+        raise RequestFailed(600, f'No scene items were found in scene `{data["sceneName"]}` '
+                                 f'with the ID `{data["sceneItemId"]}`.')
+
+    def _input(self, data):
+        if data['inputName'] not in self.inputs:
+            raise RequestFailed(600, f'No source was found by the name of `{data["inputName"]}`.')
+        return self.inputs[data['inputName']]
+
+    # General
+    def do_GetVersion(self, data):
+        return {'obsVersion': '30.0.0-mock', 'obsWebSocketVersion': self.OBS_WEBSOCKET_VERSION,
+                'rpcVersion': wsserver.RPC_VERSION, 'availableRequests': sorted(
+                    name[3:] for name in dir(self) if name.startswith('do_')),
+                'supportedImageFormats': ['png'] + (['jpg', 'webp'] if _pil() else [ ]),
+                'platform': 'mock', 'platformDescription': 'obs_cr.mockobs'}
+
+    def do_GetVideoSettings(self, data):
+        return {'baseWidth': CANVAS[0], 'baseHeight': CANVAS[1], 'outputWidth': CANVAS[0],
+                'outputHeight': CANVAS[1], 'fpsNumerator': 30, 'fpsDenominator': 1}
+
+    def do_BroadcastCustomEvent(self, data):
+        self.broadcast('CustomEvent', GENERAL, data['eventData'])
+
+    def do_GetPersistentData(self, data):
+        return {'slotValue': self.persistent.get((data['realm'], data['slotName']))}
+
+    def do_SetPersistentData(self, data):
+        self.persistent[data['realm'], data['slotName']] = data['slotValue']
+
+    # Scenes
+    def do_GetSceneList(self, data):
+        return {'currentProgramSceneName': self.program_scene,
+                'currentPreviewSceneName': self.preview_scene,
+                'scenes': [{'sceneName': name, 'sceneUuid': scene['uuid'], 'sceneIndex': i}
+                           for i, (name, scene) in enumerate(reversed(self.scenes.items()))]}
+
+    def do_GetCurrentProgramScene(self, data):
+        uuid_ = self.scenes[self.program_scene]['uuid']
+        return {'currentProgramSceneName': self.program_scene, 'currentProgramSceneUuid': uuid_,
+                'sceneName': self.program_scene, 'sceneUuid': uuid_}
+
+    def do_SetCurrentProgramScene(self, data):
+        scene = self._scene(data)
+        if data['sceneName'] != self.program_scene:
+            self.program_scene = data['sceneName']
+            self.broadcast('CurrentProgramSceneChanged', SCENES_SUB,
+                           {'sceneName': self.program_scene, 'sceneUuid': scene['uuid']})
+
+    def do_GetCurrentPreviewScene(self, data):
+        uuid_ = self.scenes[self.preview_scene]['uuid']
+        return {'currentPreviewSceneName': self.preview_scene, 'currentPreviewSceneUuid': uuid_,
+                'sceneName': self.preview_scene, 'sceneUuid': uuid_}
+
+    def do_SetCurrentPreviewScene(self, data):
+        scene = self._scene(data)
+        if data['sceneName'] != self.preview_scene:
+            self.preview_scene = data['sceneName']
+            self.broadcast('CurrentPreviewSceneChanged', SCENES_SUB,
+                           {'sceneName': self.preview_scene, 'sceneUuid': scene['uuid']})
+
+    # Scene items
+    def do_GetSceneItemList(self, data):
+        items = self._scene(data)['items']
+        return {'sceneItems': [dict(item, sceneItemIndex=i, sourceType='OBS_SOURCE_TYPE_INPUT',
+                                    sceneItemTransform=dict(item['sceneItemTransform']))
+                               for i, item in enumerate(items)]}
+
+    def do_GetSceneItemId(self, data):
+        for item in self._scene(data)['items']:
+            if item['sourceName'] == data['sourceName']:
+                return {'sceneItemId': item['sceneItemId']}
+        raise RequestFailed(600, f'No scene items were found in scene `{data["sceneName"]}` '
+                                 f'with the name `{data["sourceName"]}`.')
+
+    def do_GetSceneItemTransform(self, data):
+        transform = dict(self._scene_item(data)['sceneItemTransform'])
+        transform['width'] = transform['sourceWidth'] * transform['scaleX']
+        transform['height'] = transform['sourceHeight'] * transform['scaleY']
+        return {'sceneItemTransform': transform}
+
+    def do_SetSceneItemTransform(self, data):
+        item = self._scene_item(data)
+        transform = item['sceneItemTransform']
+        new = dict(transform, **data['sceneItemTransform'])
+        if new != transform:
+            item['sceneItemTransform'] = new
+            self.broadcast('SceneItemTransformChanged', SCENEITEMTRANSFORMCHANGED,
+                           {'sceneName': data['sceneName'], 'sceneItemId': data['sceneItemId'],
+                            'sceneItemTransform': dict(new)})
+
+    def do_GetSceneItemEnabled(self, data):
+        return {'sceneItemEnabled': self._scene_item(data)['sceneItemEnabled']}
+
+    def do_SetSceneItemEnabled(self, data):
+        item = self._scene_item(data)
+        if item['sceneItemEnabled'] != data['sceneItemEnabled']:
+            item['sceneItemEnabled'] = data['sceneItemEnabled']
+            self.broadcast('SceneItemEnableStateChanged', SCENEITEMS,
+                           {'sceneName': data['sceneName'], 'sceneItemId': data['sceneItemId'],
+                            'sceneItemEnabled': data['sceneItemEnabled']})
+
+    # Inputs
+    def do_GetInputList(self, data):
+        return {'inputs': [{'inputName': name, 'inputKind': input_['kind'], 'unversionedInputKind': input_['kind']}
+                           for name, input_ in self.inputs.items()]}
+
+    def do_GetInputMute(self, data):
+        return {'inputMuted': self._input(data)['muted']}
+
+    def do_SetInputMute(self, data):
+        input_ = self._input(data)
+        if input_['muted'] != data['inputMuted']:
+            input_['muted'] = data['inputMuted']
+            self.broadcast('InputMuteStateChanged', INPUTS,
+                           {'inputName': data['inputName'], 'inputMuted': input_['muted']})
+
+    def do_ToggleInputMute(self, data):
+        input_ = self._input(data)
+        self.do_SetInputMute(dict(data, inputMuted=not input_['muted']))
+        return {'inputMuted': input_['muted']}
+
+    def do_GetInputVolume(self, data):
+        mul = self._input(data)['volume_mul']
+        db = 20 * math.log10(mul) if mul > 0 else -100.0
+        return {'inputVolumeMul': mul, 'inputVolumeDb': db}
+
+    def do_SetInputVolume(self, data):
+        input_ = self._input(data)
+        if 'inputVolumeDb' in data:
+            mul = 10 ** (data['inputVolumeDb'] / 20)
+        else:
+            mul = data['inputVolumeMul']
+        if mul != input_['volume_mul']:
+            input_['volume_mul'] = mul
+            self.broadcast('InputVolumeChanged', INPUTS, dict(self.do_GetInputVolume(data),
+                                                              inputName=data['inputName']))
+
+    def do_GetInputSettings(self, data):
+        input_ = self._input(data)
+        return {'inputSettings': dict(input_['settings']), 'inputKind': input_['kind']}
+
+    def do_SetInputSettings(self, data):
+        input_ = self._input(data)
+        if not data.get('overlay', True):
+            input_['settings'] = { }
+        input_['settings'].update(data['inputSettings'])
+        self.broadcast('InputSettingsChanged', INPUTS,
+                       {'inputName': data['inputName'], 'inputSettings': dict(input_['settings'])})
+        if input_['media'] is not None and 'local_file' in data['inputSettings']:
+            self._media_play(data['inputName'], 0)
+
+    # Media inputs
+    def _media(self, data):
+        media = self._input(data)['media']
+        if media is None:
+            raise RequestFailed(604, 'The specified input is not a media input.')  # InvalidInputKind
+        return media
+
+    def _media_cursor(self, media):
+        if media['state'] == 'OBS_MEDIA_STATE_PLAYING':
+            return min(MEDIA_DURATION, int((time.monotonic() - media['started']) * 1000))
+        return media['cursor']
+
+    def _media_play(self, name, cursor):
+        media = self.inputs[name]['media']
+        media['id'] += 1
+        media['state'] = 'OBS_MEDIA_STATE_PLAYING'
+        media['started'] = time.monotonic() - cursor / 1000
+        self.broadcast('MediaInputPlaybackStarted', MEDIAINPUTS, {'inputName': name})
+        self._scheduler.later((MEDIA_DURATION - cursor) / 1000, self._media_ended, name, media['id'])
+
+    def _media_ended(self, name, play_id):
+        with self._state_lock:
+            media = self.inputs[name]['media']
+            if media['id'] != play_id or media['state'] != 'OBS_MEDIA_STATE_PLAYING':
+                return
+            media['state'] = 'OBS_MEDIA_STATE_ENDED'
+            media['cursor'] = MEDIA_DURATION
+        self.broadcast('MediaInputPlaybackEnded', MEDIAINPUTS, {'inputName': name})
+
+    def do_GetMediaInputStatus(self, data):
+        media = self._media(data)
+        playing = media['state'] != 'OBS_MEDIA_STATE_NONE'
+        return {'mediaState': media['state'],
+                'mediaDuration': MEDIA_DURATION if playing else None,
+                'mediaCursor': self._media_cursor(media) if playing else None}
+
+    def do_TriggerMediaInputAction(self, data):
+        media = self._media(data)
+        action = data['mediaAction']
+        if action == 'OBS_WEBSOCKET_MEDIA_INPUT_ACTION_STOP':
+            media['id'] += 1
+            media['state'], media['cursor'] = 'OBS_MEDIA_STATE_STOPPED', 0
+        elif action == 'OBS_WEBSOCKET_MEDIA_INPUT_ACTION_PAUSE' and media['state'] == 'OBS_MEDIA_STATE_PLAYING':
+            media['id'] += 1
+            media['cursor'] = self._media_cursor(media)
+            media['state'] = 'OBS_MEDIA_STATE_PAUSED'
+        elif action == 'OBS_WEBSOCKET_MEDIA_INPUT_ACTION_PLAY' and media['state'] == 'OBS_MEDIA_STATE_PAUSED':
+            self._media_play(data['inputName'], media['cursor'])
+        elif action == 'OBS_WEBSOCKET_MEDIA_INPUT_ACTION_RESTART':
+            self._media_play(data['inputName'], 0)
+        self.broadcast('MediaInputActionTriggered', MEDIAINPUTS,
+                       {'inputName': data['inputName'], 'mediaAction': action})
+
+    # Screenshots
+    def do_GetSourceScreenshot(self, data):
+        image_format = data['imageFormat']
+        if image_format not in ('png', 'jpg', 'jpeg', 'webp') or (image_format != 'png' and not _pil()):
+            raise RequestFailed(400, f'Unsupported image format `{image_format}`.')  # InvalidRequestField
+        width = int(data.get('imageWidth') or CANVAS[0])
+        height = int(data.get('imageHeight') or CANVAS[1])
+        rects = self._draw(data['sourceName'], width, height)
+        if image_format == 'png' and not _pil():
+            image = _png(width, height, rects)
+        else:
+            image = _pil_image(width, height, rects, image_format, data.get('imageCompressionQuality', -1))
+        image_format = 'jpeg' if image_format == 'jpg' else image_format
+        return {'imageData': f'data:image/{image_format};base64,' + base64.b64encode(image).decode()}
+
+    def _draw(self, name, width, height):
+        """The scene (or source) as rectangles, scaled to width x height"""
+        sx, sy = width / CANVAS[0], height / CANVAS[1]
+        rects = [(0, 0, width, height, _color(name))]
+        if name not in self.scenes:
+            return rects
+        for item in self.scenes[name]['items']:
+            t = item['sceneItemTransform']
+            if not item['sceneItemEnabled'] or item['sourceName'] == f'{name}Source':
+                continue
+            w = (t['sourceWidth'] - t['cropLeft'] - t['cropRight']) * t['scaleX']
+            h = (t['sourceHeight'] - t['cropTop'] - t['cropBottom']) * t['scaleY']
+            # alignment: 1 left, 2 right, 4 top, 8 bottom, else centered
+            x0 = t['positionX'] - (0 if t['alignment'] & 1 else w if t['alignment'] & 2 else w/2)
+            y0 = t['positionY'] - (0 if t['alignment'] & 4 else h if t['alignment'] & 8 else h/2)
+            rects.append((int(x0 * sx), int(y0 * sy), int((x0 + w) * sx), int((y0 + h) * sy),
+                          _color(item['sourceName'])))
+        return rects
+
+
+def _pil():
+    try:
+        import PIL  # pylint: disable=unused-import,import-outside-toplevel
+    except ImportError:
+        return False
+    return True
+
+def _pil_image(width, height, rects, image_format, quality):
+    from PIL import Image, ImageDraw  # pylint: disable=import-outside-toplevel
+    image = Image.new('RGB', (width, height))
+    draw = ImageDraw.Draw(image)
+    for x0, y0, x1, y1, color in rects:
+        if x0 < x1 and y0 < y1:
+            draw.rectangle((x0, y0, x1 - 1, y1 - 1), fill=color)
+    out = io.BytesIO()
+    kwargs = {'quality': quality} if quality is not None and quality >= 0 else { }
+    image.save(out, format={'jpg': 'JPEG', 'jpeg': 'JPEG'}.get(image_format, image_format.upper()), **kwargs)
+    return out.getvalue()
+
+
+
+def start(address=('127.0.0.1', 0), **kwargs):
+    """Start a MockObs in a background thread.  Returns it, see .server_address."""
+    server = MockObs(address, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True, name='mockobs').start()
+    return server
+
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Pretend to be OBS, for testing the panels.")
+    parser.add_argument('--listen', default='127.0.0.1:4455',
+                        help="HOST:PORT to listen on (default %(default)s)")
+    parser.add_argument('--password', help="Require this password (default: none)")
+    parser.add_argument('--latency', type=float, default=0,
+                        help="Delay of every response and event, in ms (default %(default)s)")
+    parser.add_argument('--jitter', type=float, default=0,
+                        help="Random extra +- delay, in ms (default %(default)s)")
+    parser.add_argument('--verbose', '-v', action='count', default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)])
+
+    host, port = args.listen.rsplit(':', 1)
+    server = MockObs((host, int(port)), password=args.password,
+                     latency=args.latency/1000, jitter=args.jitter/1000)
+    print(f'Mock OBS on {args.listen}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print('Requests:', dict(server.stats))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,73 +1,557 @@
 import argparse
 import os
 import base64
+import bisect
+import collections
+import hashlib
 import io
+import logging
+import threading
+import time
 
 from tkinter import *
 from tkinter import ttk
-from PIL import Image, ImageTk
 
-def get_image(w=840//2, h=1080//2):
+from .util import Newest, Repaint
+
+# PIL and obsws_python are imported in main(), after the window is up
+Image = ImageTk = None
+
+LOG = logging.getLogger(__name__)
+
+# The program scene, kept current by events (see track_program_scene())
+program_scene = None
+# For --multiview: all scenes (in the order of the OBS scene list) and
+# the studio mode preview scene (None without studio mode), kept current
+# by events (see track_scenes())
+scene_names = [ ]
+preview_scene = None
+# The time being replayed (see replay_controls()), None when live
+replay_at = None
+# Frame below the picture with the replay controls, if any
+controls = None
+# Screenshot format and quality (from the command line).  PNG is slow
+# for OBS to encode, big to send and slow to decode; JPEG is much
+# cheaper for video.
+image_format = 'jpg'
+image_quality = 75
+POLL = 10  # ms, how often Tk looks for a new frame
+BACKOFF = 1  # s, wait after a failed screenshot
+# Screenshot widths to ask for (the height keeps the canvas aspect), so
+# that a window being resized doesn't ask for a new size every frame
+SIZE_BUCKETS = (160, 320, 480, 640, 960, 1280, 1920)
+MAX_SIZE = 4096  # Largest screenshot side that OBS makes
+# Width / height of the OBS canvas, set from OBS in main()
+aspect = 840 / 1080
+RESIZE_DEBOUNCE = 200  # ms after the last resize event
+START_WIDTH = 420  # Window width at startup, the height is from the canvas aspect
+max_size = 1280  # Largest screenshot width to ask for (from the command line)
+
+def request_size(w, h):
+    """(screenshot size, display size) for a window of w x h.
+
+    The screenshot is the smallest bucket that is at least as big as the
+    window (but at most max_size wide), and is scaled locally to the
+    display size, the biggest that fits in the window.
+    """
+    fit = max(50, min(w, round(h * aspect)))
+    widths = sorted({b for b in SIZE_BUCKETS if b < max_size} | {max_size})
+    width = next((b for b in widths if b >= fit), widths[-1])
+    return (width, round(width / aspect)), (fit, round(fit / aspect))
+
+def start_size():
+    """request_size() of the window at startup, START_WIDTH wide"""
+    return request_size(START_WIDTH, round(START_WIDTH / aspect))
+
+def request_image(w, h, source=None):
+    """Ask for a screenshot of source (default the program scene).  Returns a future."""
     w = max(w, 50)
     h = max(h, 50)
-    w = min(w, 1920)
-    h = min(h, 1080)
-    source = cl1.get_current_program_scene().current_program_scene_name
-    image = cl1.get_source_screenshot(source, 'png', w, h, -1).image_data
-    image = base64.b64decode(image.split(',')[1])
-    image = Image.open(io.BytesIO(image))
+    w = min(w, MAX_SIZE)
+    h = min(h, MAX_SIZE)
+    return cl1.get_source_screenshot(source or program_scene, image_format, w, h, image_quality)
+
+def screenshot_bytes(data):
+    """The image file (compressed) in a screenshot response"""
+    return base64.b64decode(data.image_data.split(',')[1])
+
+def open_image(raw):
+    """Decode an image file"""
+    image = Image.open(io.BytesIO(raw))
+    image.load()
     return image
 
+def decode_image(data):
+    """(image, bytes, decode time in s) of a screenshot response"""
+    start = time.perf_counter()
+    raw = screenshot_bytes(data)
+    image = open_image(raw)
+    return image, len(raw), time.perf_counter() - start
 
-def update_image(delay):
-    print("Updating...")
-    w, h = root.winfo_width(), root.winfo_height()
-    print(w, h)
-    image = get_image(w, h)
-    #image_new = image.resize((w, h))
-    #print(image_new)
-    pi = ImageTk.PhotoImage(image)
-    background.configure(image=pi)
-    background.img = pi
+def get_image(w, h):
+    return decode_image(request_image(w, h).result())[0]
+
+
+def track_program_scene(obs):
+    """Keep program_scene current, so each frame is only one request"""
+    def on_current_program_scene_changed(data):
+        global program_scene
+        program_scene = data.scene_name
+    def fetch():
+        def done(future):
+            global program_scene
+            if future.exception() is None:
+                program_scene = future.result().current_program_scene_name
+        obs.req.get_current_program_scene().add_done_callback(done)
+    # Subscribe before asking, so that no change is missed in between
+    obs.callback.register(on_current_program_scene_changed)
+    obs.on_reconnect.append(fetch)
+    global program_scene
+    program_scene = obs.req.get_current_program_scene().result().current_program_scene_name
+
+
+def track_scenes(obs):
+    """Keep scene_names and preview_scene current, for --multiview"""
+    def fetch_scenes():
+        def done(future):
+            global scene_names
+            if future.exception() is None:
+                scenes = sorted(future.result().scenes, key=lambda scene: -scene['sceneIndex'])
+                scene_names = [scene['sceneName'] for scene in scenes]
+        obs.req.get_scene_list().add_done_callback(done)
+    def fetch_preview():
+        def done(future):
+            global preview_scene
+            # This fails without studio mode
+            preview_scene = future.result().current_preview_scene_name if future.exception() is None else None
+        obs.req.send('GetCurrentPreviewScene').add_done_callback(done)
+    def on_current_preview_scene_changed(data):
+        global preview_scene
+        preview_scene = data.scene_name
+    def on_studio_mode_state_changed(data):
+        global preview_scene
+        if data.studio_mode_enabled:
+            fetch_preview()
+        else:
+            preview_scene = None
+    def fetch():
+        fetch_scenes()
+        fetch_preview()
+    # Handlers are found by their names, so each needs its own function
+    def on_scene_created(data):
+        fetch_scenes()
+    def on_scene_removed(data):
+        fetch_scenes()
+    def on_scene_name_changed(data):
+        fetch_scenes()
+    def on_scene_list_changed(data):
+        fetch_scenes()
+    obs.callback.register([on_scene_created, on_scene_removed, on_scene_name_changed,
+                           on_scene_list_changed, on_current_preview_scene_changed,
+                           on_studio_mode_state_changed])
+    obs.on_reconnect.append(fetch)
+    fetch()
+
+
+class ReplayBuffer:
+    """The frames of the last `seconds`, as compressed image files.
+
+    Only changed frames are added, so a frame is shown until the next
+    one.  A frame is dropped once the next one is older than `seconds`
+    too (until then it was still shown within the last `seconds`), or
+    when all frames together are more than `max_bytes` (the newest is
+    always kept), so the memory used is bounded whatever the frame rate.
+    Frames are only decoded when viewed.  Thread-safe.
+    """
+    def __init__(self, seconds, max_bytes):
+        self.seconds = seconds
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._times = collections.deque()   # time.time() of each frame
+        self._frames = collections.deque()  # image files
+        self._lock = threading.Lock()
+
+    def add(self, raw, when=None):
+        when = time.time() if when is None else when
+        with self._lock:
+            self._times.append(when)
+            self._frames.append(raw)
+            self.bytes += len(raw)
+            while len(self._frames) > 1 and (self.bytes > self.max_bytes
+                                             or when - self._times[1] >= self.seconds):
+                self._times.popleft()
+                self.bytes -= len(self._frames.popleft())
+
+    def at(self, when):
+        """(time, image file) of the frame shown at `when`, or None if that's too old"""
+        with self._lock:
+            i = bisect.bisect_right(self._times, when)
+            return (self._times[i-1], self._frames[i-1]) if i else None
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class Producer:
+    """Fetch and decode frames in a background thread.
+
+    One screenshot request is in flight at a time, sent every `delay`
+    seconds (or as soon as the previous one is answered, if that takes
+    longer).  The next request is sent before the last response is
+    decoded, when it is already due.  Decoded frames go to `frames`,
+    which only keeps the newest, for the Tk thread to show, scaled to the
+    display size.  Both sizes are set with resize() from the Tk thread
+    (see request_size()).
+
+    Frames that are the same as the last one (compared by a hash of the
+    response, before decoding) are skipped.  While they keep being the
+    same, the interval grows by SLOWDOWN up to `max_delay`; any change,
+    or wake(), goes back to `delay`.
+
+    If `replay` (a ReplayBuffer) is given, the frames are saved in it too.
+    """
+    SLOWDOWN = 1.5
+    def __init__(self, delay, max_delay=None, replay=None):
+        self.delay = self.interval = delay
+        self.replay = replay
+        self.max_delay = max(delay, max_delay if max_delay is not None else delay)
+        self.size, self.display = start_size()
+        self.frames = Newest()
+        self.skipped = 0  # unchanged frames
+        self._last_hash = None
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='preview-frames')
+        self._thread.start()
+
+    def wake(self):
+        """Something changed (like the scene): get the next frame now"""
+        self.interval = self.delay
+        self._wake.set()
+
+    def close(self):
+        """Stop fetching, once the request in flight is answered"""
+        self._closed = True
+        self._wake.set()
+
+    def resize(self, size, display):
+        """Ask for screenshots of size, and show them at display size"""
+        if (size, display) == (self.size, self.display):
+            return
+        self.size, self.display = size, display
+        self.refresh()  # Show the next frame at the new size
+
+    def refresh(self):
+        """Send on the next frame, even if it didn't change"""
+        self._last_hash = None
+        self.wake()
+
+    def fit(self, image):
+        """image scaled to the display size"""
+        if image.size != self.display:
+            image = image.resize(self.display, Image.BILINEAR)
+        return image
+
+    def _decode(self, data):
+        start = time.perf_counter()
+        raw = screenshot_bytes(data)
+        if self.replay is not None:
+            self.replay.add(raw)
+        image = self.fit(open_image(raw))
+        return image, len(raw), time.perf_counter() - start
+
+    def _run(self):
+        pending = None
+        while not self._closed:
+            if pending is None:
+                self._wake.clear()
+                sent = time.monotonic()
+                pending = request_image(*self.size)
+            try:
+                data = pending.result()
+            except Exception as e:  # pylint: disable=broad-except
+                # Keep the old image, the connection is re-made in the
+                # background (sending may fail with anything meanwhile)
+                LOG.error('Could not get image: %s', e)
+                pending = None
+                time.sleep(max(self.delay, BACKOFF))
+                continue
+            pending = None
+            digest = hashlib.blake2b(data.image_data.encode(), digest_size=16).digest()
+            changed = digest != self._last_hash
+            self._last_hash = digest
+            if changed:
+                self.interval = self.delay
+            else:
+                self.skipped += 1
+                self.interval = min(self.interval * self.SLOWDOWN, self.max_delay)
+            if time.monotonic() >= sent + self.interval:
+                self._wake.clear()
+                sent = time.monotonic()
+                pending = request_image(*self.size)
+            if changed:
+                try:
+                    self.frames.put(self._decode(data))
+                except Exception:  # pylint: disable=broad-except
+                    LOG.exception('Could not decode image')
+            if pending is None:
+                self._wake.wait(max(0, sent + self.interval - time.monotonic()))
+
+
+def watch_size(producer):
+    """Resize the screenshots to the window, once it has stopped changing"""
+    pending = None
+    def resized():
+        nonlocal pending
+        pending = None
+        height = root.winfo_height() - (controls.winfo_height() if controls is not None else 0)
+        producer.resize(*request_size(root.winfo_width(), height))
+    def configure(event):
+        nonlocal pending
+        if event.widget is not root:
+            return
+        if pending is not None:
+            root.after_cancel(pending)
+        pending = root.after(RESIZE_DEBOUNCE, resized)
+    root.bind('<Configure>', configure)
+
+
+def update_image(producer, scene=None):
+    """Show the newest frame, if there is one (in the Tk thread)"""
+    if program_scene != scene:
+        producer.wake()
+        scene = program_scene
+    frame = producer.frames.get()
+    if frame is not None and replay_at is None:
+        image, size, decode = frame
+        #image_new = image.resize((w, h))
+        #print(image_new)
+        pi = ImageTk.PhotoImage(image)
+        background.configure(image=pi)
+        background.img = pi
+        root.title(f"OBS preview - {image.width}x{image.height} {image_format}"
+                   f" {size/1000:.0f} kB, decode {decode*1000:.1f} ms, {producer.skipped} unchanged")
     #background.pack(fill=BOTH, expand=YES)
     #frm.pack()
-    root.after(max(100, int(delay*1000)), update_image, delay)
+    root.after(POLL, update_image, producer, scene)
+
+def replay_controls(producer, replay):
+    """A slider to look at what was shown up to replay.seconds ago"""
+    global controls
+    controls = ttk.Frame(root)
+    controls.pack(fill=X)
+    def go_live():
+        global replay_at
+        if replay_at is not None:
+            replay_at = None
+            position.configure(text='Live')
+            producer.refresh()
+    def show(value):
+        global replay_at
+        ago = -float(value)
+        if ago <= 0:
+            go_live()
+            return
+        replay_at = time.time() - ago
+        frame = replay.at(replay_at)
+        if frame is None:
+            position.configure(text='(not that far back)')
+            return
+        when, raw = frame
+        pi = ImageTk.PhotoImage(producer.fit(open_image(raw)))
+        background.configure(image=pi)
+        background.img = pi
+        position.configure(text=f"{time.strftime('%H:%M:%S', time.localtime(when))}, "
+                                f"{time.time() - when:.1f} s ago")
+    def live():
+        scale.set(0)
+        go_live()
+    scale = ttk.Scale(controls, from_=-replay.seconds, to=0, command=show)
+    scale.pack(side=LEFT, fill=X, expand=YES)
+    position = ttk.Label(controls, text='Live', width=22)
+    position.pack(side=LEFT)
+    ttk.Button(controls, text='Live', command=live).pack(side=LEFT)
+
+
+def multiview_tiles():
+    """The tiles of the multiview, [(key, label, source, big)].
+
+    Program and studio mode preview are big, on top, then each scene.
+    """
+    tiles = [('program', f'Program: {program_scene}', program_scene, True)]
+    if preview_scene is not None:
+        tiles.insert(0, ('preview', f'Preview: {preview_scene}', preview_scene, True))
+    tiles.extend((('scene', name), name, name, False) for name in scene_names)
+    return tiles
+
+
+class Multiview:
+    """Fetch and decode the multiview tiles in a background thread.
+
+    The tiles are fetched round-robin, one screenshot every `delay`
+    seconds in total, so the load on OBS doesn't depend on the number of
+    scenes (each tile is updated every len(tiles)*delay seconds).  Small
+    tiles are `width` wide and big ones twice that.  As in Producer,
+    unchanged frames are skipped.  `frames` (tile key: Newest of (image,
+    bytes, decode time)) is read by the Tk thread.
+    """
+    def __init__(self, delay, width):
+        self.delay = delay
+        # Heights from the canvas aspect, see main()
+        self.sizes = {False: (width, round(width / aspect)), True: (2*width, round(2*width / aspect))}
+        self.frames = { }
+        self.skipped = 0  # unchanged frames
+        self._hashes = { }  # tile key: hash of the last frame
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='multiview-frames')
+        self._thread.start()
+
+    def close(self):
+        """Stop fetching, after the current tile"""
+        self._closed = True
+
+    def _run(self):
+        i = 0
+        while not self._closed:
+            start = time.monotonic()
+            tiles = multiview_tiles()
+            key, _, source, big = tiles[i % len(tiles)]
+            i += 1
+            try:
+                data = request_image(*self.sizes[big], source=source).result()
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.error('Could not get image of %s: %s', source, e)
+                time.sleep(BACKOFF)
+            else:
+                digest = hashlib.blake2b(data.image_data.encode(), digest_size=16).digest()
+                if digest == self._hashes.get(key):
+                    self.skipped += 1
+                else:
+                    self._hashes[key] = digest
+                    try:
+                        self.frames.setdefault(key, Newest()).put(decode_image(data))
+                    except Exception:  # pylint: disable=broad-except
+                        LOG.exception('Could not decode image')
+            time.sleep(max(0, start + self.delay - time.monotonic()))
+
+
+def update_multiview(multiview, frm, columns, labels=None):
+    """Lay out the tiles when they change, and show new frames (in the Tk thread)"""
+    tiles = multiview_tiles()
+    if labels is None or list(labels) != [tile[0] for tile in tiles]:
+        # Keep the labels (and their last frames) of the tiles that stay
+        old = labels or { }
+        labels = { }
+        row, column = 0, 0
+        for i, (key, _, _, big) in enumerate(tiles):
+            span = 2 if big else 1
+            # A new row when this one is full, and after the big tiles
+            if column and (column + span > columns or (not big and tiles[i-1][3])):
+                row, column = row + 1, 0
+            labels[key] = old.pop(key, None) or Label(frm, compound='top', highlightthickness=3)
+            labels[key].grid(row=row, column=column, columnspan=span, padx=2, pady=2)
+            column += span
+        for label in old.values():
+            label.destroy()
+        root.title(f"OBS multiview - {len(tiles)} tiles, each every {len(tiles)*multiview.delay:.1f} s")
+    for key, text, source, big in tiles:
+        label = labels[key]
+        color = ('red' if source == program_scene else
+                 'green' if source == preview_scene else default_color)
+        repaint.configure(label, text=text, highlightbackground=color, highlightcolor=color)
+        frame = multiview.frames.get(key)
+        frame = frame.get() if frame is not None else None
+        if frame is not None:
+            pi = ImageTk.PhotoImage(frame[0])
+            label.configure(image=pi)
+            label.img = pi
+    root.after(POLL, update_multiview, multiview, frm, columns, labels)
+
 
 def main():
+    global image_format, image_quality, max_size
     parser = argparse.ArgumentParser()
     parser.add_argument('hostname_port')
     parser.add_argument('password', default=os.environ.get('OBS_PASSWORD'),
                       help='or set env var OBS_PASSWORD')
     parser.add_argument('--delay', '-d', type=float, default=0.1, help="Update latency (default %(default)s)")
+    parser.add_argument('--max-delay', type=float, default=1,
+                        help="While the picture doesn't change, slow down to this delay (default %(default)s, use the same as --delay to not slow down)")
+    parser.add_argument('--max-size', type=int, default=max_size,
+                        help="Largest screenshot width to ask OBS for, bigger windows scale it up (default %(default)s)")
+    parser.add_argument('--replay', type=float, default=60,
+                        help="Keep this many seconds of frames, to look back at with the slider (default %(default)s, 0 for none)")
+    parser.add_argument('--replay-memory', type=float, default=100,
+                        help="Memory for --replay, MB; older frames are dropped beyond this (default %(default)s)")
+    parser.add_argument('--multiview', action='store_true',
+                        help="Show thumbnails of all scenes (and the program and studio mode preview) instead, "
+                             "fetched one at a time every --delay seconds")
+    parser.add_argument('--tile-width', type=int, default=320,
+                        help="With --multiview, screenshot width of the scene thumbnails (default %(default)s, program and preview are twice that)")
+    parser.add_argument('--columns', type=int, default=4,
+                        help="With --multiview, number of thumbnails per row (default %(default)s)")
+    parser.add_argument('--format', '-f', choices=['png', 'jpg', 'webp'], default=image_format,
+                        help="Screenshot format (default %(default)s)")
+    parser.add_argument('--quality', '-q', type=int, default=image_quality,
+                        help="Screenshot compression quality, 0-100, or -1 for the OBS default (default %(default)s, not used for png)")
     args = parser.parse_args()
+    image_format = args.format
+    max_size = args.max_size
+    image_quality = args.quality if args.format != 'png' else -1
     hostname = args.hostname_port.split(':')[0]
     port = args.hostname_port.split(':')[1]
     password = args.password
 
-    # OBS websocket
-    import obsws_python as obs
-    global cl1
-    cl1 = obs.ReqClient(host=hostname, port=port, password=password, timeout=3)
-
-
     global root
     root = Tk()
     root.title("OBS preview")
+    root.update()
+
+    global Image, ImageTk
+    from PIL import Image, ImageTk
+
+    # OBS websocket
+    from . import connection
+    global cl1
+    obs = connection.Supervisor(host=hostname, port=port, password=password, timeout=3)
+    cl1 = obs.req
+    track_program_scene(obs)
+    global aspect
+    video = cl1.get_video_settings().result()
+    aspect = video.base_width / video.base_height
+
     frm = ttk.Frame(root, padding=0)
     frm.pack()
-    image = get_image(840//2, 1080//2)
-    print(image)
-    w = image.width
-    h = image.height
-    print(w, h)
-    root.geometry(f"{w}x{h}")
+    if args.multiview:
+        global repaint, default_color
+        repaint = Repaint(root)
+        default_color = root.cget('background')
+        track_scenes(obs)
+        update_multiview(Multiview(delay=args.delay, width=args.tile_width), frm, args.columns)
+        root.mainloop()
+        return
+    size, display = start_size()
+    image = get_image(*size)
+    if image.size != display:
+        image = image.resize(display, Image.BILINEAR)
+    w, h = display
 
     #frm.pack(fill=BOTH, expand=YES)
-    pi = ImageTk.PhotoImage(get_image())
+    pi = ImageTk.PhotoImage(image)
     global background
     background = Label(frm, image=pi)
+    background.img = pi
     background.pack(fill=BOTH, expand=YES)
-    update_image(delay=args.delay)
+    replay = None
+    if args.replay > 0:
+        replay = ReplayBuffer(args.replay, args.replay_memory * 1e6)
+    producer = Producer(delay=args.delay, max_delay=args.max_delay, replay=replay)
+    if replay is not None:
+        replay_controls(producer, replay)
+        h += controls.winfo_reqheight()
+    root.geometry(f"{w}x{h}")
+    watch_size(producer)
+    update_image(producer)
 
     #ttk.Label(frm, image=pi)
     #canvas = Canvas(root, width=300, height=300)
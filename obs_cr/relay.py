@@ -0,0 +1,331 @@
+"""Relay: one connection to OBS, shared by many control panels.
+
+Every panel normally connects to OBS itself, and OBS (which is also
+encoding the stream) answers each one's requests and polls.  The relay
+keeps one connection to OBS and looks like OBS to the panels, so they
+connect to it instead, with no other changes:
+
+    obs-cr-relay OBS_HOST:PORT PASSWORD --listen 0.0.0.0:4456
+    obs-cr-control RELAY_HOST:4456 PASSWORD
+
+The relay keeps the state that ObsState syncs in memory: persistent
+data (kept current by the versioned custom events that go with each
+write), the program scene, and input mute and volume (kept current by
+their events).  Reads of these are answered from memory, and writes
+that would change nothing (or that are older than the saved version)
+are not passed on.  For persistent data, that is compared with what
+was last written to or read from OBS, not with the events, since
+panels re-save values that OBS may not have.  Everything else is
+forwarded to OBS, and events are passed on to the panels that
+subscribed to them.  Each panel is sent to from its own thread (see
+wsserver.Session), and a panel that can't keep up is disconnected, so
+one slow panel doesn't hold up the others.
+
+When the connection to OBS is lost and made again, all panels are
+disconnected, so that they reconnect and resync everything that they
+might have missed.
+"""
+
+from concurrent.futures import Future
+import json
+import logging
+import os
+import threading
+
+import obsws_python
+
+from . import connection
+from . import wsserver
+from .wsserver import response
+
+LOG = logging.getLogger(__name__)
+
+Subs = obsws_python.Subs
+PROFILE = 'OBS_WEBSOCKET_DATA_REALM_PROFILE'
+
+
+def _key(request_type, request_data):
+    return (request_type, json.dumps(request_data or { }, sort_keys=True))
+
+def _version(saved):
+    """Version of a saved ObsState value (see ObsState._unpack), or None"""
+    if isinstance(saved, dict) and set(saved) == {'value', 'seq', 'writer'}:
+        return (saved['seq'], saved['writer'])
+    return None
+
+
+
+class Relay(wsserver.ObsWsServer):
+    """obs-websocket server that relays to one OBS connection (a connection.Supervisor)."""
+    # Requests answered from memory, once known
+    CACHED = {'GetVersion', 'GetPersistentData', 'GetCurrentProgramScene',
+              'GetInputMute', 'GetInputVolume'}
+    # Events that the cache needs, whatever the panels subscribe to
+    CACHE_SUBS = Subs.GENERAL | Subs.SCENES | Subs.INPUTS
+    def __init__(self, address, password, obs):
+        super().__init__(address, password=password)
+        self.obs = obs
+        self._cache = { }  # (requestType, requestData json): responseData
+        self._saved = { }  # GetPersistentData key: slotValue last written to or read from OBS
+        self._cache_lock = threading.Lock()
+        self.stats = {'requests': 0, 'cached': 0, 'deduplicated': 0, 'forwarded': 0}
+        obs.on_event.append(self.obs_event)
+        obs.on_reconnect.append(self.obs_reconnected)
+        obs.subscribe(self.CACHE_SUBS)
+
+    # Cache
+    def _get(self, request_type, request_data):
+        with self._cache_lock:
+            return self._cache.get(_key(request_type, request_data))
+
+    def _set(self, request_type, request_data, data, replace=True):
+        with self._cache_lock:
+            key = _key(request_type, request_data)
+            if replace or key not in self._cache:
+                self._cache[key] = data
+
+    def _set_slot(self, slot, slot_value):
+        """Cache a persistent data value, unless the cached one is a newer version"""
+        key = _key('GetPersistentData', slot)
+        with self._cache_lock:
+            current = self._cache.get(key)
+            new_version, current_version = _version(slot_value), current and _version(current['slotValue'])
+            if new_version and current_version and new_version < current_version:
+                return
+            self._cache[key] = {'slotValue': slot_value}
+
+    def _clear(self):
+        with self._cache_lock:
+            self._cache.clear()
+            self._saved.clear()
+
+    def cached(self, d):
+        """The cached response to the request d, or None"""
+        if d['requestType'] not in self.CACHED:
+            return None
+        data = self._get(d['requestType'], d.get('requestData'))
+        if data is None:
+            return None
+        return response(d, data)
+
+    def duplicate(self, d):
+        """If the write request d would change nothing, a response for it (or None)"""
+        request_type = d['requestType']
+        data = d.get('requestData') or { }
+        if request_type == 'SetPersistentData':
+            key = _key('GetPersistentData', {'realm': data.get('realm'), 'slotName': data.get('slotName')})
+            with self._cache_lock:
+                if key not in self._saved:
+                    return None
+                saved = self._saved[key]
+            new_version, saved_version = _version(data.get('slotValue')), _version(saved)
+            if saved == data.get('slotValue') \
+               or (new_version and saved_version and new_version < saved_version):
+                return response(d)
+        elif request_type == 'SetCurrentProgramScene':
+            current = self._get('GetCurrentProgramScene', None)
+            if current is not None and current['currentProgramSceneName'] == data.get('sceneName'):
+                return response(d)
+        elif request_type == 'SetInputMute':
+            current = self._get('GetInputMute', {'inputName': data.get('inputName')})
+            if current is not None and current['inputMuted'] == data.get('inputMuted'):
+                return response(d)
+        elif request_type == 'SetInputVolume':
+            current = self._get('GetInputVolume', {'inputName': data.get('inputName')})
+            if current is not None and 'inputVolumeDb' in data \
+               and current['inputVolumeDb'] == data['inputVolumeDb']:
+                return response(d)
+        return None
+
+    def forwarding(self, d):
+        """Remember what the write request d, about to be forwarded, saves in OBS"""
+        if d['requestType'] == 'SetPersistentData':
+            data = d.get('requestData') or { }
+            with self._cache_lock:
+                self._saved[_key('GetPersistentData', {'realm': data.get('realm'),
+                                                       'slotName': data.get('slotName')})] = data.get('slotValue')
+
+    def learn(self, d, result):
+        """Update the cache from a forwarded request d and its response data result"""
+        if not result['requestStatus']['result']:
+            return
+        request_type = d['requestType']
+        data = d.get('requestData') or { }
+        if request_type in self.CACHED:
+            # An event may have updated it while the request was out
+            self._set(request_type, data, result.get('responseData', { }), replace=False)
+            if request_type == 'GetPersistentData':
+                # Unless a write was forwarded meanwhile, this is what OBS has
+                with self._cache_lock:
+                    self._saved.setdefault(_key(request_type, data),
+                                           result.get('responseData', { }).get('slotValue'))
+        elif request_type == 'SetPersistentData':
+            # A newer version may have arrived in an event meanwhile
+            self._set_slot({'realm': data.get('realm'), 'slotName': data.get('slotName')},
+                           data.get('slotValue'))
+
+    # Requests from the panels
+    def request(self, session, d):
+        self.stats['requests'] += 1
+        result = self.cached(d)
+        if result is not None:
+            self.stats['cached'] += 1
+            return result
+        result = self.duplicate(d)
+        if result is not None:
+            self.stats['deduplicated'] += 1
+            LOG.debug('Not forwarding %s, it changes nothing', d)
+            return result
+        self.stats['forwarded'] += 1
+        self.forwarding(d)
+        def done(result):
+            self.learn(d, result)
+            return result
+        return self._forward(6, d, done)
+
+    def batch(self, session, d):
+        requests = d.get('requests', [ ])
+        self.stats['requests'] += len(requests)
+        if not all(request['requestType'] in self.CACHED for request in requests):
+            # Writes have to run in order with the rest, so forward it all.
+            self.stats['forwarded'] += len(requests)
+            for request in requests:
+                self.forwarding(request)
+            def done(result):
+                for request, result_ in zip(requests, result['results']):
+                    self.learn(request, result_)
+                return result
+            return self._forward(8, d, done)
+        # Only reads (like a panel's startup): answer what we know, and
+        # forward the rest as a smaller batch.
+        results = [self.cached(request) for request in requests]
+        missing = [request for (request, result) in zip(requests, results) if result is None]
+        self.stats['cached'] += len(requests) - len(missing)
+        if not missing:
+            return {'requestId': d.get('requestId'), 'results': results}
+        self.stats['forwarded'] += len(missing)
+        def done(result):
+            forwarded = {result_.get('requestId'): result_ for result_ in result['results']}
+            for i, request in enumerate(requests):
+                if results[i] is None:
+                    results[i] = forwarded.get(request.get('requestId')) \
+                        or response(request, result=False, code=207, comment='Not run')
+                    self.learn(request, results[i])
+            result['results'] = results
+            return result
+        return self._forward(8, dict(d, requests=missing), done)
+
+    def _forward(self, op, d, func):
+        """Send d to OBS.  Returns a future of func(response), with the panel's requestId."""
+        new = Future()
+        def done(future):
+            if future.exception() is not None:
+                e = future.exception()
+                if op == 6:
+                    result = response(d, result=False, code=207, comment=f'OBS: {e}')  # NotReady
+                else:
+                    result = {'results': [response(request, result=False, code=207, comment=f'OBS: {e}')
+                                          for request in d['requests']]}
+            else:
+                result = func(future.result())
+            result['requestId'] = d.get('requestId')
+            new.set_result(result)
+        self.obs.engine.forward(op, d).add_done_callback(done)
+        return new
+
+    # Events from OBS
+    def obs_event(self, event_type, data):
+        """Keep the cache up to date, then pass the event on to the panels."""
+        if event_type == 'CustomEvent':
+            # ObsState sends the versioned value with each write
+            versions = data.get('_sync', { })
+            for name, value in data.items():
+                if name == '_sync':
+                    continue
+                slot = {'realm': PROFILE, 'slotName': name}
+                if name not in versions:
+                    # Unknown whether (or how) it was saved
+                    with self._cache_lock:
+                        self._cache.pop(_key('GetPersistentData', slot), None)
+                    continue
+                seq, writer = versions[name]
+                self._set_slot(slot, {'value': value, 'seq': seq, 'writer': writer})
+        elif event_type == 'CurrentProgramSceneChanged':
+            self._set('GetCurrentProgramScene', None,
+                      {'currentProgramSceneName': data['sceneName'], 'sceneName': data['sceneName'],
+                       'currentProgramSceneUuid': data.get('sceneUuid'), 'sceneUuid': data.get('sceneUuid')})
+        elif event_type == 'InputMuteStateChanged':
+            self._set('GetInputMute', {'inputName': data['inputName']}, {'inputMuted': data['inputMuted']})
+        elif event_type == 'InputVolumeChanged':
+            self._set('GetInputVolume', {'inputName': data['inputName']},
+                      {'inputVolumeMul': data['inputVolumeMul'], 'inputVolumeDb': data['inputVolumeDb']})
+        elif event_type in {'InputNameChanged', 'InputRemoved', 'SceneNameChanged',
+                            'CurrentProfileChanged', 'CurrentSceneCollectionChanged'}:
+            self._clear()
+        self.broadcast(event_type, connection.EVENT_SUBS.get(event_type, Subs.LOW_VOLUME), data)
+
+    def obs_reconnected(self):
+        LOG.warning('Reconnected to OBS, dropping the cache and the panels')
+        self._clear()
+        with self._lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.close(1012, 'Reconnected to OBS')  # Service restart
+
+    # Panels
+    def identified(self, session):
+        LOG.info('Panel %s, event subscriptions %r', session.address, session.subs)
+        self._subscribe()
+
+    def closed(self, session):
+        LOG.info('Panel %s disconnected', session.address)
+        self._subscribe()
+
+    def _subscribe(self):
+        """Subscribe to what the cache and all panels need"""
+        subs = self.CACHE_SUBS
+        with self._lock:
+            for session in self.sessions:
+                subs |= session.subs
+        self.obs.subscribe(subs)
+
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Relay one OBS connection to many control panels.")
+    parser.add_argument('hostname_port',
+                        help="HOSTNAME:PORT of the OBS to connect to")
+    parser.add_argument('password', default=os.environ.get('OBS_PASSWORD'),
+                      help='Websocket password, or pass "-" and set env var OBS_PASSWORD')
+    parser.add_argument('--listen', default='127.0.0.1:4456',
+                        help="HOST:PORT to listen on for panels (default %(default)s, use 0.0.0.0:PORT for all interfaces)")
+    parser.add_argument('--relay-password',
+                        help="Password that panels need (default: the OBS password)")
+    parser.add_argument('--verbose', '-v', action='count', default=0)
+    args = parser.parse_args()
+    if args.verbose >= 2:
+        logging.basicConfig(level=logging.DEBUG)
+        logging.getLogger('obsws_python').setLevel(logging.INFO)
+    else:
+        logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    password = args.password
+    if password == '-':
+        password = os.environ['OBS_PASSWORD']
+    hostname, port = args.hostname_port.split(':')
+    obs = connection.Supervisor(host=hostname, port=port, password=password, timeout=3)
+    listen_host, listen_port = args.listen.rsplit(':', 1)
+    relay = Relay((listen_host, int(listen_port)), args.relay_password or password, obs)
+    print(f'Relaying {args.hostname_port} on {args.listen}')
+    try:
+        relay.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        relay.server_close()
+        obs.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""Small helpers for futures and Tk, that don't need OBS.
+"""
+
+from concurrent.futures import Future
+import logging
+import queue
+import sys
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+
+def then(future, func):
+    """Return a future of func(result of future), once it is done.
+
+    If func returns a Future itself, the returned future follows that
+    one.  func runs in whichever thread completes the future (usually the
+    RequestEngine reader), so it must not block waiting for a response.
+    Exceptions are passed on to the returned future.
+    """
+    new = Future()
+    def follow(future):
+        if future.exception() is not None:
+            new.set_exception(future.exception())
+        else:
+            new.set_result(future.result())
+    def done(future):
+        try:
+            result = func(future.result())
+        except Exception as e:  # pylint: disable=broad-except
+            new.set_exception(e)
+            return
+        if isinstance(result, Future):
+            result.add_done_callback(follow)
+        else:
+            new.set_result(result)
+    future.add_done_callback(done)
+    return new
+
+
+
+class TkDispatcher:
+    """Run callbacks in the Tk main loop, requested from any thread.
+
+    Tk may only be used from its own thread, so functions are queued
+    here and the queue is emptied by a root.after() loop.
+    """
+    def __init__(self, root, interval=10):
+        self.root = root
+        self.interval = interval  # ms
+        self._queue = queue.SimpleQueue()
+        self.root.after(self.interval, self._run)
+
+    def call(self, func, *args):
+        """Run func(*args) in the Tk thread"""
+        self._queue.put((func, args))
+
+    def on_result(self, future, func, errback=None):
+        """When future is done, run func(result) in the Tk thread.
+
+        If it failed, run errback(exception) instead (if given).  The
+        failure has already been logged by the RequestEngine.
+        """
+        def done(future):
+            if future.exception() is not None:
+                if errback is not None:
+                    self.call(errback, future.exception())
+                return
+            self.call(func, future.result())
+        future.add_done_callback(done)
+
+    def _run(self):
+        while True:
+            try:
+                func, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                func(*args)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception('Exception in callback %s', func)
+        self.root.after(self.interval, self._run)
+
+
+
+class Newest:
+    """A one-slot queue that only keeps the newest item.
+
+    put() replaces whatever is there, get() takes it out (or returns
+    None), so a slow consumer skips to the latest instead of falling
+    behind.  Thread-safe.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._item = None
+
+    def put(self, item):
+        with self._lock:
+            self._item = item
+
+    def get(self):
+        with self._lock:
+            item, self._item = self._item, None
+        return item
+
+
+
+class Repaint:
+    """Diffed, coalesced widget.configure().
+
+    configure(widget, **options) remembers the options, and once Tk is
+    idle (after the current batch of events) applies only the options
+    that differ from what was last applied to that widget.  So several
+    updates of a widget in one batch become one repaint, and updates
+    that change nothing cost nothing.
+
+    Options set through here should only be set through here, otherwise
+    the remembered values are out of date.
+    """
+    def __init__(self, root):
+        self.root = root
+        self._applied = { }  # widget: {option: value}
+        self._queued = { }   # widget: {option: value}
+        self._scheduled = False
+
+    def configure(self, widget, **options):
+        """Queue widget.configure(**options)"""
+        self._queued.setdefault(widget, { }).update(options)
+        if not self._scheduled:
+            self._scheduled = True
+            self.root.after_idle(self.flush)
+
+    def flush(self):
+        """Apply the queued options now"""
+        self._scheduled = False
+        queued, self._queued = self._queued, { }
+        for widget, options in queued.items():
+            applied = self._applied.setdefault(widget, { })
+            changed = {k: v for k, v in options.items()
+                       if k not in applied or applied[k] != v}
+            if not changed:
+                continue
+            try:
+                widget.configure(**changed)
+            except Exception:  # pylint: disable=broad-except
+                LOG.exception('Could not configure %s with %s', widget, changed)
+                continue
+            applied.update(changed)
+
+
+
+class PhaseTimer:
+    """Time the phases of something (like startup), for a breakdown.
+
+    mark(name) ends the phase `name`, which started at the previous
+    mark (or at creation).
+    """
+    def __init__(self):
+        self.start = self._last = time.perf_counter()
+        self.phases = [ ]  # (name, seconds, note)
+
+    def mark(self, name, note=''):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last, note))
+        self._last = now
+
+    def report(self, file=sys.stderr):
+        width = max((len(name) for name, _, _ in self.phases), default=0)
+        for name, seconds, note in self.phases:
+            print(f'{name:{width}}  {seconds*1000:7.1f} ms  {note}', file=file)
+        print(f"{'total':{width}}  {(self._last - self.start)*1000:7.1f} ms", file=file)
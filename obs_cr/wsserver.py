@@ -0,0 +1,359 @@
+"""A small obs-websocket (v5) server, on the standard library only.
+
+This is the server side of the protocol that obsws_python (and so
+RequestEngine) speaks: the websocket handshake and framing (RFC 6455,
+text messages only), then Hello/Identify (with the same password
+authentication as OBS), Reidentify, requests and request batches.
+ObsWsServer doesn't answer any requests itself; subclasses implement
+request() for that.
+"""
+
+import base64
+import collections
+from concurrent.futures import Future
+import hashlib
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+
+LOG = logging.getLogger(__name__)
+
+GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+RPC_VERSION = 1
+
+
+
+class WebSocket:
+    """Server side of one websocket connection."""
+    def __init__(self, rfile, wfile, sock=None):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.sock = sock
+        self._lock = threading.Lock()
+        self.closed = False
+
+    def handshake(self):
+        """Read the HTTP upgrade request and answer it.  Returns success."""
+        headers = { }
+        request_line = self.rfile.readline()
+        while True:
+            line = self.rfile.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if not request_line or headers.get('upgrade', '').lower() != 'websocket' \
+           or 'sec-websocket-key' not in headers:
+            self.wfile.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+        accept = base64.b64encode(hashlib.sha1((headers['sec-websocket-key'] + GUID).encode()).digest())
+        response = ['HTTP/1.1 101 Switching Protocols',
+                    'Upgrade: websocket',
+                    'Connection: Upgrade',
+                    f'Sec-WebSocket-Accept: {accept.decode()}']
+        if 'obswebsocket.json' in headers.get('sec-websocket-protocol', ''):
+            response.append('Sec-WebSocket-Protocol: obswebsocket.json')
+        self.wfile.write(('\r\n'.join(response) + '\r\n\r\n').encode())
+        return True
+
+    def _read_exactly(self, n):
+        data = self.rfile.read(n)
+        if len(data) < n:
+            raise ConnectionError('Connection closed')
+        return data
+
+    def _read_frame(self):
+        b0, b1 = self._read_exactly(2)
+        length = b1 & 0x7f
+        if length == 126:
+            length, = struct.unpack('!H', self._read_exactly(2))
+        elif length == 127:
+            length, = struct.unpack('!Q', self._read_exactly(8))
+        mask = self._read_exactly(4) if b1 & 0x80 else None
+        payload = self._read_exactly(length)
+        if mask and length:
+            # XOR with the repeated mask, all at once
+            mask = (mask * (length // 4 + 1))[:length]
+            payload = (int.from_bytes(payload, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(length, 'big')
+        return bool(b0 & 0x80), b0 & 0x0f, payload
+
+    def recv(self):
+        """Next text message, or None when the connection is closed."""
+        message = [ ]
+        while not self.closed:
+            try:
+                fin, opcode, payload = self._read_frame()
+            except (ConnectionError, OSError, ValueError):
+                self.closed = True
+                return None
+            if opcode == 8:    # close
+                self.close()
+                return None
+            if opcode == 9:    # ping
+                self._send_frame(10, payload)
+                continue
+            if opcode == 10:   # pong
+                continue
+            message.append(payload)
+            if fin:
+                return b''.join(message).decode('utf-8')
+        return None
+
+    def _send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, length)
+        elif length < 2**16:
+            header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+        with self._lock:
+            self.wfile.write(header + payload)
+
+    def send(self, text):
+        """Send a text message"""
+        self._send_frame(1, text.encode('utf-8'))
+
+    def close(self, code=1000, reason=''):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self._send_frame(8, struct.pack('!H', code) + reason.encode('utf-8'))
+        except OSError:
+            pass
+
+    def abort(self):
+        """Drop the connection at once, even if a send is stuck"""
+        self.closed = True
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+
+class Session:
+    """One obs-websocket client of an ObsWsServer.
+
+    Messages are sent by a writer thread of the session's own, so that a
+    slow client doesn't hold up the thread that sends to it (for the
+    relay, the one reading from OBS, which serves all clients).  A client
+    that falls MAX_QUEUE messages behind is dropped.
+    """
+    MAX_QUEUE = 1000
+    def __init__(self, server, ws, address):
+        self.server = server
+        self.ws = ws
+        self.address = address
+        self.subs = 0
+        self.identified = False
+        self.closing = False
+        self._queue = queue.Queue(self.MAX_QUEUE)  # message text, or (code, reason) to close
+        self._writer = threading.Thread(target=self._write, daemon=True,
+                                        name=f'session-{address[0]}:{address[1]}')
+        self._writer.start()
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            LOG.warning('%s is not keeping up, dropping it', self)
+            self.closing = True
+            self.ws.abort()
+
+    def _write(self):
+        while True:
+            item = self._queue.get()
+            if self.ws.closed:
+                return
+            if isinstance(item, tuple):
+                self.ws.close(*item)
+                return
+            try:
+                self.ws.send(item)
+            except OSError as e:
+                LOG.info('Could not send to %s: %s', self.address, e)
+                self.ws.closed = True
+                return
+
+    def send(self, op, d):
+        if self.closing or self.ws.closed:
+            return
+        self._put(json.dumps({'op': op, 'd': d}))
+
+    def event(self, event_type, intent, data):
+        """Send the event, if this client subscribed to it"""
+        if self.identified and self.subs & intent:
+            d = {'eventType': event_type, 'eventIntent': int(intent)}
+            if data:
+                d['eventData'] = data
+            self.send(5, d)
+
+    def close(self, code=1000, reason=''):
+        """Close the connection, after what was sent before"""
+        if self.closing:
+            return
+        self.closing = True
+        self._put((code, reason))
+
+    def wait_sent(self, timeout=5):
+        """Wait for the writer to finish after close(), or drop the connection"""
+        self._writer.join(timeout)
+        if self._writer.is_alive():
+            self.ws.abort()
+
+    def __repr__(self):
+        return f'<Session {self.address[0]}:{self.address[1]}>'
+
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        ws = WebSocket(self.rfile, self.wfile, self.request)
+        if not ws.handshake():
+            return
+        self.server.serve_session(Session(self.server, ws, self.client_address))
+
+
+
+def request_status(result=True, code=100, comment=None):
+    status = {'result': result, 'code': code}
+    if comment:
+        status['comment'] = comment
+    return status
+
+def response(request, data=None, result=True, code=100, comment=None):
+    """A response (op 7 data) to the request (op 6 data)"""
+    d = {'requestType': request['requestType'],
+         'requestId': request.get('requestId'),
+         'requestStatus': request_status(result, code, comment)}
+    if data is not None:
+        d['responseData'] = data
+    return d
+
+
+
+class ObsWsServer(socketserver.ThreadingTCPServer):
+    """An obs-websocket server, one thread per client.
+
+    Subclasses implement request(session, d), which returns the response
+    (see response()) or a Future of it.  Request batches run each request
+    in turn with request(), unless batch() is overridden too.  Events are
+    sent to all interested clients with broadcast().
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    OBS_WEBSOCKET_VERSION = '5.0.0'
+    def __init__(self, address, password=None):
+        super().__init__(address, _Handler)
+        self.password = password
+        self.sessions = set()
+        self.received = collections.Counter()  # op: number of messages
+        self._lock = threading.Lock()
+
+    # Protocol
+    def serve_session(self, session):
+        hello = {'obsWebSocketVersion': self.OBS_WEBSOCKET_VERSION, 'rpcVersion': RPC_VERSION}
+        if self.password:
+            auth = hello['authentication'] = {
+                'challenge': base64.b64encode(os.urandom(32)).decode(),
+                'salt': base64.b64encode(os.urandom(32)).decode(),
+                }
+        session.send(0, hello)
+        try:
+            while True:
+                message = session.ws.recv()
+                if message is None:
+                    break
+                try:
+                    message = json.loads(message)
+                    op, d = message['op'], message.get('d', { })
+                except (ValueError, KeyError, TypeError):
+                    session.close(4002, 'Invalid message')  # DecodeError
+                    break
+                self.received[op] += 1
+                if not session.identified:
+                    if op != 1:
+                        session.close(4003, 'Not identified')  # NotIdentified
+                        break
+                    if self.password and d.get('authentication') != self._auth(auth):
+                        session.close(4009, 'Authentication failed')  # AuthenticationFailed
+                        break
+                    session.subs = d.get('eventSubscriptions', 0)
+                    session.identified = True
+                    with self._lock:
+                        self.sessions.add(session)
+                    session.send(2, {'negotiatedRpcVersion': RPC_VERSION})
+                    self.identified(session)
+                elif op == 3:
+                    session.subs = d.get('eventSubscriptions', session.subs)
+                    session.send(2, {'negotiatedRpcVersion': RPC_VERSION})
+                    self.identified(session)
+                elif op == 6:
+                    self._reply(session, 7, self._request(session, d))
+                elif op == 8:
+                    self._reply(session, 9, self.batch(session, d))
+                else:
+                    session.close(4004, f'Unknown op {op}')  # UnknownOpCode
+                    break
+        finally:
+            with self._lock:
+                self.sessions.discard(session)
+            session.close()
+            session.wait_sent()
+            self.closed(session)
+
+    def _auth(self, auth):
+        secret = base64.b64encode(hashlib.sha256((self.password + auth['salt']).encode()).digest())
+        return base64.b64encode(hashlib.sha256(secret + auth['challenge'].encode()).digest()).decode()
+
+    def _request(self, session, d):
+        try:
+            return self.request(session, d)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.exception('Request %s failed', d)
+            return response(d, result=False, code=205, comment=f'{type(e).__name__}: {e}')  # RequestProcessingFailed
+
+    @staticmethod
+    def _reply(session, op, result):
+        if isinstance(result, Future):
+            result.add_done_callback(lambda f: session.send(op, f.result()))
+        else:
+            session.send(op, result)
+
+    def batch(self, session, d):
+        """Run a request batch (op 8 data).  Returns the op 9 data."""
+        results = [ ]
+        for request in d.get('requests', [ ]):
+            result = self._request(session, request)
+            if isinstance(result, Future):
+                result = result.result()
+            results.append(result)
+            if d.get('haltOnFailure') and not result['requestStatus']['result']:
+                break
+        return {'requestId': d.get('requestId'), 'results': results}
+
+    def broadcast(self, event_type, intent, data=None):
+        """Send an event to every client subscribed to `intent`"""
+        with self._lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            session.event(event_type, intent, data)
+
+    # For subclasses
+    def request(self, session, d):
+        """Answer one request (op 6 data), with response() or a Future of it."""
+        return response(d, result=False, code=204, comment='Unknown request type')  # UnknownRequestType
+
+    def identified(self, session):
+        """A client identified, or changed its event subscriptions"""
+
+    def closed(self, session):
+        """A client disconnected"""
@@ -0,0 +1,107 @@
+"""Fixtures: a mock OBS, the relay, and panels' ObsStates connected to them."""
+
+import threading
+import time
+
+import pytest
+
+from obs_cr import connection, control, mockobs, relay as relay_
+
+
+@pytest.fixture(scope='session')
+def display():
+    """Skip the test if Tk can't open a window here"""
+    import tkinter
+    try:
+        tkinter.Tk().destroy()
+    except tkinter.TclError as e:
+        pytest.skip(f'Tk needs a display: {e}')
+
+
+@pytest.fixture
+def mock():
+    """A mock OBS, with the scenes and inputs that control.py expects"""
+    server = mockobs.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def settle(mock):
+    """settle(quiet): wait until the mock has had no requests for `quiet` s"""
+    def settle(quiet=0.2):
+        last = None
+        while True:
+            time.sleep(quiet)
+            count = sum(mock.stats.values())
+            if count == last:
+                return
+            last = count
+    return settle
+
+
+class InlineDispatcher:
+    """Like util.TkDispatcher, but runs the callbacks right away, in
+    whichever thread finishes the request"""
+    def call(self, func, *args):
+        func(*args)
+    def on_result(self, future, func, errback=None):
+        def done(future):
+            if future.exception() is not None:
+                if errback is not None:
+                    errback(future.exception())
+                return
+            func(future.result())
+        future.add_done_callback(done)
+
+@pytest.fixture
+def dispatch(monkeypatch):
+    """control.dispatch without Tk"""
+    dispatcher = InlineDispatcher()
+    monkeypatch.setattr(control, 'dispatch', dispatcher, raising=False)
+    return dispatcher
+
+
+@pytest.fixture
+def relay(mock):
+    """A relay to the mock OBS"""
+    obs = connection.Supervisor(*mock.server_address, None)
+    server = relay_.Relay(('127.0.0.1', 0), None, obs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    obs.close()
+
+
+@pytest.fixture
+def panels():
+    """panels(n, address): n (Supervisor, ObsState) connected to address"""
+    made = [ ]
+    def panels(n, address):
+        new = [ ]
+        for _ in range(n):
+            cl = connection.Supervisor(*address, None)
+            made.append(cl)
+            new.append((cl, control.ObsState(cl.req, cl)))
+        return new
+    yield panels
+    for cl in made:
+        cl.close()
+
+
+@pytest.fixture
+def write_at_once():
+    """write_at_once(panels, name): each panel sets name to its index, all at once"""
+    def write_at_once(panels, name):
+        barrier = threading.Barrier(len(panels))
+        def write(state, value):
+            barrier.wait()
+            state[name] = value
+        threads = [threading.Thread(target=write, args=(state, i)) for i, (_, state) in enumerate(panels)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return write_at_once
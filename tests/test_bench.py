@@ -0,0 +1,33 @@
+"""The benchmark comparison, and a real run where Tk can run"""
+
+import argparse
+
+from obs_cr import bench
+
+
+def _result(messages, requests, latency):
+    return {'messages': messages, 'requests': requests, 'latency_s': latency}
+
+def test_compare_flags_regressions(capsys):
+    old = {'actions': {'same': _result(3, 2, 0.1), 'worse': _result(3, 2, 0.1),
+                       'faster': _result(3, 2, 0.5), 'noise': _result(1, 1, 0.010)},
+           'startup': [{'presets': 0, 'indicators': 0, 'messages': 10, 'requests': 20, 'startup_s': 0.5}]}
+    new = {'actions': {'same': _result(3, 2, 0.1), 'worse': _result(4, 3, 0.3),
+                       'faster': _result(3, 2, 0.2), 'noise': _result(1, 1, 0.020),
+                       'new': _result(1, 1, 1)},
+           'startup': [{'presets': 0, 'indicators': 0, 'messages': 10, 'requests': 21, 'startup_s': 0.5}]}
+    assert bench.compare(old, new, threshold=1.25) == 2
+    lines = {line.split()[0]: line for line in capsys.readouterr().out.splitlines()[1:]}
+    assert lines['worse'].endswith('MORE MESSAGES MORE REQUESTS SLOWER')
+    assert lines['startup'].endswith('MORE REQUESTS')
+    # 2x slower, but less than QUIET: just noise
+    assert not lines['noise'].endswith('SLOWER')
+    assert 'new' not in lines
+
+
+def test_bench_startup(display):
+    args = argparse.Namespace(rtt=0, repeat=1)
+    result = bench._run_child(args, '--child', 'startup', '--presets', '2', '--indicators', '2')
+    assert result['presets'] == result['indicators'] == 2
+    assert result['requests'] > 0 and result['messages'] > 0
+    assert result['startup_s'] > 0
@@ -0,0 +1,92 @@
+"""Supervisor reconnection and event subscriptions, against the mock OBS"""
+
+import threading
+import time
+
+from obs_cr import connection, mockobs
+from obs_cr.relay import PROFILE
+
+
+def _drop(mock):
+    """Drop the connections of all clients, without closing them properly"""
+    for session in list(mock.sessions):
+        session.ws.abort()
+
+
+def test_supervisor_reconnects_after_obs_restart():
+    mock = mockobs.start()
+    address = mock.server_address
+    cl = connection.Supervisor(*address, None)
+    try:
+        reconnected = threading.Event()
+        cl.on_reconnect.append(reconnected.set)
+        scenes = [ ]
+        def on_current_program_scene_changed(data):
+            scenes.append(data.scene_name)
+        cl.callback.register(on_current_program_scene_changed)
+        req = cl.req
+        # OBS goes away for a while: the reconnection is retried
+        mock.shutdown()
+        _drop(mock)
+        mock.server_close()
+        time.sleep(3 * connection.Supervisor.BACKOFF_MAX)
+        assert not reconnected.is_set()
+        mock = mockobs.start(address)
+        assert reconnected.wait(5)
+        # The same req and handlers work, with the new connection
+        assert cl.req is req
+        assert req.get_version().result().obs_web_socket_version == mock.OBS_WEBSOCKET_VERSION
+        req.set_current_program_scene('Gallery')
+        deadline = time.monotonic() + 5
+        while not scenes and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert scenes == ['Gallery']
+    finally:
+        cl.close()
+        mock.shutdown()
+        mock.server_close()
+
+
+def test_resync_runs_watchers_of_changed_keys(mock, settle, panels, dispatch):
+    (cl, state), = panels(1, mock.server_address)
+    mock.persistent[PROFILE, 'a'] = {'value': 1, 'seq': 1, 'writer': 'x'}
+    mock.persistent[PROFILE, 'b'] = {'value': 2, 'seq': 1, 'writer': 'x'}
+    seen = [ ]
+    for name in 'ab':
+        state._watch_init(name, lambda value, name=name: seen.append((name, value)))
+    state._hydrate()
+    settle()
+    assert sorted(seen) == [('a', 1), ('b', 2)]
+    seen.clear()
+    # Changed while we were away: no event for it
+    mock.persistent[PROFILE, 'a'] = {'value': 3, 'seq': 2, 'writer': 'x'}
+    reconnected = threading.Event()
+    cl.on_reconnect.append(reconnected.set)
+    _drop(mock)
+    assert reconnected.wait(5)
+    state._resync()
+    settle()
+    assert seen == [('a', 3)]
+
+
+def test_subscriptions():
+    Subs = connection.Subs
+    assert connection.subscriptions([]) == 0
+    assert connection.subscriptions(['CurrentProgramSceneChanged', 'SceneListChanged']) == Subs.SCENES
+    assert connection.subscriptions(['InputMuteStateChanged', 'SceneItemTransformChanged']) \
+        == Subs.INPUTS | Subs.SCENEITEMTRANSFORMCHANGED
+    assert connection.subscriptions(['NoSuchEvent']) == Subs.LOW_VOLUME
+
+
+def test_supervisor_subscribes_to_registered_handlers(mock, settle):
+    cl = connection.Supervisor(*mock.server_address, None, subs=connection.Subs.GENERAL)
+    try:
+        session, = mock.sessions
+        assert session.subs == connection.Subs.GENERAL
+        def on_scene_item_transform_changed(data):
+            pass
+        cl.callback.register(on_scene_item_transform_changed)
+        settle()
+        assert session.subs == connection.Subs.GENERAL | connection.Subs.SCENEITEMTRANSFORMCHANGED
+    finally:
+        cl.close()
@@ -0,0 +1,176 @@
+"""Parts of the control panel that work without Tk or OBS"""
+
+import concurrent.futures
+import time
+
+import pytest
+
+from obs_cr import control, mockobs
+
+
+class FakeWidget:
+    """Records .after() calls, run with run_after()"""
+    def __init__(self):
+        self.scheduled = [ ]
+    def after(self, ms, func, *args):
+        self.scheduled.append((ms, func, args))
+        return len(self.scheduled)
+    def run_after(self):
+        scheduled, self.scheduled = self.scheduled, [ ]
+        for ms, func, args in scheduled:
+            func(*args)
+
+
+def test_throttle_coalesces(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    widget = FakeWidget()
+    sent = [ ]
+    throttle = control.Throttle(widget, sent.append, rate=10)
+    throttle(1)                        # the first call goes out at once
+    assert sent == [1]
+    now[0] += 0.03
+    for value in (2, 3, 4):            # too soon: held back, newest kept
+        throttle(value)
+    assert sent == [1]
+    assert [ms for ms, _, _ in widget.scheduled] == [70]
+    now[0] += 0.07
+    widget.run_after()
+    assert sent == [1, 4]
+    now[0] += 0.5                      # after a pause, at once again
+    throttle(5)
+    assert sent == [1, 4, 5] and widget.scheduled == [ ]
+
+
+@pytest.fixture
+def obsreq(mock, panels, monkeypatch):
+    """control's module globals for requests, connected to the mock"""
+    (cl, _), = panels(1, mock.server_address)
+    monkeypatch.setattr(control, 'obsreq', cl.req, raising=False)
+    monkeypatch.setattr(control, 'obssubscribe', cl.callback.register, raising=False)
+    return cl.req
+
+
+def test_set_pip_transform_one_batch(mock, settle, obsreq, monkeypatch):
+    monkeypatch.setattr(control, 'scene_items', control.SceneItemIndex(mock.scenes), raising=False)
+    control.scene_items.load().result()
+    settle()
+    mock.received.clear()
+    mock.stats.clear()
+    control.set_pip_transform({'cropLeft': 10, 'cropRight': 20})
+    settle()
+    assert mock.received == {8: 1}     # one RequestBatch, no single requests
+    assert mock.stats == {'SetSceneItemTransform': len(control.SCENES_WITH_PIP)}
+    for scene in mock.scenes.values():
+        for item in scene['items']:
+            transform = item['sceneItemTransform']
+            if item['sourceName'] == control.PIP:
+                assert (transform['cropLeft'], transform['cropRight']) == (10, 20)
+            else:
+                assert transform['cropLeft'] == 0
+
+
+def test_scene_item_index_invalidated_by_events(mock, settle, obsreq):
+    index = control.SceneItemIndex(mock.scenes)
+    settle()                           # the subscription to SceneItemCreated
+    pip_id = {item['sourceName']: item['sceneItemId'] for item in mock.scenes['Screenshare']['items']}[control.PIP]
+    assert index.get('Screenshare', control.PIP).result() == pip_id
+    assert index.get('Title', control.PIP).result() is None
+    assert mock.stats['GetSceneItemList'] == len(mock.scenes)  # fetched once
+    # A new item: the event drops the index, and the next lookup sees it
+    with mock._state_lock:
+        item = mock._item(control.PIP, 1920, 1080)
+        mock.scenes['Title']['items'].append(item)
+    mock.broadcast('SceneItemCreated', mockobs.SCENEITEMS,
+                   {'sceneName': 'Title', 'sourceName': control.PIP,
+                    'sceneItemId': item['sceneItemId'], 'sceneItemIndex': 1})
+    settle()
+    assert index.get('Title', control.PIP).result() == item['sceneItemId']
+    assert mock.stats['GetSceneItemList'] == 2 * len(mock.scenes)
+
+
+class FakeVar:
+    """Like tkinter's DoubleVar"""
+    def __init__(self, value=0.0):
+        self._value = value
+    def get(self):
+        return self._value
+    def set(self, value):
+        self._value = value
+
+def _pip_size(sizes):
+    """A PipSize without Tk, whose polls get sizes[0], sizes[1], ..."""
+    pip_size = object.__new__(control.PipSize)
+    widget = FakeWidget()
+    sizes = iter(sizes)
+    def get_size():
+        future = concurrent.futures.Future()
+        future.set_result(next(sizes))
+        return future
+    pip_size.__dict__.update(
+        widget=widget, after=widget.after, value=FakeVar(0.25), get_size=get_size,
+        obs_update=lambda state: pip_size.value.set(state),
+        events_ok=False, expect_event=None, poll_interval=control.PipSize.POLL_MIN)
+    return pip_size
+
+def _polls(pip_size, n):
+    """Run the next n polls, return the intervals scheduled after them"""
+    intervals = [ ]
+    for _ in range(n):
+        pip_size.widget.run_after()
+        intervals.append(pip_size.widget.scheduled[0][0])
+    return intervals
+
+def test_pip_size_poll_backs_off(dispatch):
+    pip_size = _pip_size([0.25] * 6 + [0.5, 0.5])
+    pip_size.update_pip_size()
+    assert pip_size.widget.scheduled[0][0] == 2000
+    # Unchanged: the interval doubles up to POLL_MAX, a change resets it
+    assert _polls(pip_size, 7) == [4000, 8000, 16000, 16000, 16000, 1000, 2000]
+    assert pip_size.value.get() == 0.5
+
+def test_pip_size_trusts_events(dispatch, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    pip_size = _pip_size([0.25])
+    pip_size.events_ok = True
+    pip_size.update_pip_size()         # no requests: the one size is for later
+    assert _polls(pip_size, 2) == [1000, 1000]
+    # Our change doesn't come back as an event: back to polling
+    pip_size.expect_event = now[0]
+    now[0] += control.PipSize.EVENT_WAIT + 1
+    assert _polls(pip_size, 1) == [2000]
+    assert not pip_size.events_ok
+
+
+def test_playback_timer_counts_down_locally(mock, settle, obsreq, dispatch):
+    timer = object.__new__(control.PlaybackTimer)
+    widget = FakeWidget()
+    shown = [ ]
+    timer.__dict__.update(input_name='CRaudio', sync_id=0, widget=widget, after=widget.after,
+                          show=lambda duration, cursor: shown.append((duration, cursor)))
+    control.obssubscribe([timer.on_media_input_action_triggered])
+    settle()
+    obsreq.trigger_media_input_action('CRaudio', 'OBS_WEBSOCKET_MEDIA_INPUT_ACTION_RESTART')
+    settle()
+    assert mock.stats['GetMediaInputStatus'] == 1
+    assert shown and shown[-1][0] == mockobs.MEDIA_DURATION
+    assert sorted(ms for ms, _, _ in widget.scheduled) == [timer.TICK, timer.RESYNC]
+    (_, resync, resync_args), = [s for s in widget.scheduled if s[0] == timer.RESYNC]
+    # Ticks count down without asking OBS
+    for _ in range(3):
+        time.sleep(timer.TICK / 1000)
+        (_, tick, args), = [s for s in widget.scheduled if s[0] == timer.TICK]
+        widget.scheduled.clear()
+        tick(*args)
+    assert [cursor for _, cursor in shown] == sorted(cursor for _, cursor in shown)
+    assert shown[-1][1] >= 3 * timer.TICK
+    assert mock.stats['GetMediaInputStatus'] == 1
+    # The periodic resync asks again, and stops the old countdown
+    shown.clear()
+    resync(*resync_args)
+    settle()
+    assert mock.stats['GetMediaInputStatus'] == 2
+    assert len(shown) == 1
+    tick(*args)
+    assert len(shown) == 1
@@ -0,0 +1,47 @@
+"""Request and event metrics."""
+
+from concurrent.futures import Future
+
+from obs_cr.metrics import Metrics
+
+
+def _parse(text):
+    """Prometheus text → {sample with labels: value string}"""
+    samples = { }
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = value
+    return samples
+
+def test_prometheus():
+    metrics = Metrics()
+    future = Future()
+    metrics.request('GetVersion', future)
+    assert _parse(metrics.prometheus())['obs_cr_requests_in_flight'] == '1'
+    future.set_result(None)
+    metrics.event('CustomEvent', 1.0, 1.5, 1.75)
+    samples = _parse(metrics.prometheus())
+    assert samples['obs_cr_requests_total{request="GetVersion"}'] == '1'
+    assert samples['obs_cr_requests_in_flight'] == '0'
+    assert samples['obs_cr_request_duration_seconds_count{request="GetVersion"}'] == '1'
+    assert samples['obs_cr_request_duration_seconds_bucket{request="GetVersion",le="+Inf"}'] == '1'
+    assert samples['obs_cr_events_total{event="CustomEvent"}'] == '1'
+    assert samples['obs_cr_event_dispatch_delay_seconds_sum'] == '0.5'
+    assert samples['obs_cr_event_handler_seconds_bucket{le="0.25"}'] == '1'
+
+def test_prometheus_large_counts_not_rounded():
+    metrics = Metrics()
+    metrics.events['CustomEvent'] = 1234567
+    metrics.started -= 1234567.25
+    samples = _parse(metrics.prometheus())
+    assert samples['obs_cr_events_total{event="CustomEvent"}'] == '1234567'
+    assert float(samples['obs_cr_uptime_seconds']) >= 1234567.25
+
+def test_write_prometheus(tmp_path):
+    metrics = Metrics()
+    metrics.reconnected()
+    filename = tmp_path / 'obs_cr.prom'
+    metrics.write_prometheus(str(filename))
+    assert _parse(filename.read_text())['obs_cr_reconnects_total'] == '1'
+    assert [path.name for path in tmp_path.iterdir()] == ['obs_cr.prom']  # No temporary file left
@@ -0,0 +1,30 @@
+"""The mock OBS itself."""
+
+import time
+
+from obs_cr import connection, mockobs
+
+
+def test_jitter_keeps_order():
+    """Messages to one client arrive in order, whatever the jitter"""
+    mock = mockobs.start(latency=0.02, jitter=0.02)
+    host, port = mock.server_address
+    sender = connection.Supervisor(host, port, None)
+    receiver = connection.Supervisor(host, port, None)
+    got = [ ]
+    def on_custom_event(data):
+        got.append(data.n)
+    try:
+        receiver.callback.register(on_custom_event)
+        time.sleep(0.3)
+        for n in range(20):
+            sender.req.broadcast_custom_event({'eventData': {'n': n}})
+        deadline = time.monotonic() + 5
+        while len(got) < 20 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert got == list(range(20))
+    finally:
+        sender.close()
+        receiver.close()
+        mock.shutdown()
+        mock.server_close()
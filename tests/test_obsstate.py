@@ -0,0 +1,93 @@
+"""ObsState syncing of values between panels, against the mock OBS."""
+
+from obs_cr import control
+from obs_cr.relay import PROFILE
+
+
+class FakeReq:
+    """Records the requests that ObsState sends"""
+    def __init__(self):
+        self.sent = [ ]
+    def set_persistent_data(self, realm, name, value):
+        self.sent.append(('SetPersistentData', name, value))
+    def broadcast_custom_event(self, data):
+        self.sent.append(('BroadcastCustomEvent', data['eventData']))
+
+class FakeEv:
+    class callback:
+        @staticmethod
+        def register(fns):
+            pass
+
+
+def _state():
+    state = control.ObsState(FakeReq(), FakeEv())
+    object.__setattr__(state, '_writer', 'b')
+    return state
+
+def test_newer_value_accepted():
+    state = _state()
+    state['x'] = 1                     # version (1, 'b')
+    assert state._update('x', 2, (2, 'a'))
+    assert state['x'] == 2
+    assert not state._update('x', 3, (1, 'c'))
+    assert state['x'] == 2
+
+def test_stale_value_resaved_with_event():
+    state = _state()
+    state['x'] = 1                     # version (1, 'b')
+    state._req.sent.clear()
+    assert not state._update('x', 0, (1, 'a'))
+    # The re-save is announced too, so that a newer writer can correct it
+    assert state._req.sent == [
+        ('SetPersistentData', 'x', {'value': 1, 'seq': 1, 'writer': 'b'}),
+        ('BroadcastCustomEvent', {'x': 1, '_sync': {'x': [1, 'b']}}),
+        ]
+
+
+def test_simultaneous_writers(mock, settle, panels, write_at_once):
+    """Three panels write the same key at once: OBS ends up with the
+    value that all panels show."""
+    states = panels(3, mock.server_address)
+    for trial in range(20):
+        name = f'key{trial}'
+        write_at_once(states, name)
+        settle()
+        values = {state._cache[name] for _, state in states}
+        assert len(values) == 1
+        assert mock.persistent[PROFILE, name]['value'] in values
+
+
+def test_uncached_reads_dont_wait(mock, settle, panels, dispatch):
+    """Reading a key that isn't cached returns None at once, and the
+    watchers get the value when it arrives."""
+    (_, state), = panels(1, mock.server_address)
+    mock.inputs[control.AUDIO_INPUT]['muted'] = False
+    seen = [ ]
+    state._watch('muted', lambda value: seen.append(('muted', value)))
+    state._watch('muted_brcd', lambda value: seen.append(('muted_brcd', value)))
+    mock.latency = 0.2
+    assert state.muted is None
+    assert state.muted_brcd is None
+    assert state.muted is None  # still one request
+    settle(quiet=0.5)
+    assert sorted(seen) == [('muted', False), ('muted_brcd', True)]
+    assert (state.muted, state.muted_brcd) == (False, True)
+    assert mock.stats['GetInputMute'] == 2
+
+def test_hydrate_runs_initial_callbacks(mock, settle, panels, dispatch):
+    (cl, state), = panels(1, mock.server_address)
+    cl.req.set_persistent_data(PROFILE, 'x', {'value': 5, 'seq': 1, 'writer': 'a'})
+    settle()
+    seen = [ ]
+    state._init('x', seen.append)
+    state._init('scene', seen.append)
+    assert seen == [ ]
+    hydrated = [ ]
+    state._hydrate(then=lambda: hydrated.append(True))
+    settle()
+    assert seen == [5, mock.program_scene] and hydrated == [True]
+    # After _hydrate(), uncached keys are fetched first
+    state._init('y', seen.append)
+    settle()
+    assert seen[-1] is None
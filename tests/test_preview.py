@@ -0,0 +1,177 @@
+"""Parts of the preview that don't need Tk, against the mock OBS."""
+
+import time
+
+import pytest
+from PIL import Image
+
+from obs_cr import preview
+from obs_cr.preview import ReplayBuffer
+
+
+@pytest.fixture
+def obs(mock, panels, monkeypatch):
+    """A connection to the mock, as the preview's cl1"""
+    (cl, _), = panels(1, mock.server_address)
+    monkeypatch.setattr(preview, 'cl1', cl.req, raising=False)
+    monkeypatch.setattr(preview, 'Image', Image)
+    for name in ['program_scene', 'scene_names', 'preview_scene', 'image_format', 'image_quality',
+                 'aspect']:
+        monkeypatch.setattr(preview, name, getattr(preview, name))
+    return cl
+
+@pytest.fixture
+def producer(obs):
+    """producer(**kwargs): a Producer, closed after the test"""
+    made = [ ]
+    def producer(**kwargs):
+        made.append(preview.Producer(**kwargs))
+        return made[-1]
+    yield producer
+    for producer_ in made:
+        producer_.close()
+        producer_._thread.join(5)
+
+
+def test_replay_keeps_frame_shown_at_window_start():
+    replay = ReplayBuffer(60, 10**6)
+    replay.add(b'slide1', 0)
+    replay.add(b'slide2', 100)
+    # slide1 was still shown 60 s before the last frame
+    assert replay.at(90) == (0, b'slide1')
+    assert replay.at(100) == (100, b'slide2')
+    assert replay.at(-1) is None
+    replay.add(b'slide3', 170)
+    assert len(replay) == 2
+    assert replay.at(115) == (100, b'slide2')
+
+def test_replay_memory_cap():
+    replay = ReplayBuffer(60, 250)
+    for i in range(10):
+        replay.add(b'x' * 100, i)
+    assert replay.bytes == 200
+    assert replay.at(9) == (9, b'x' * 100)
+    assert replay.at(7) is None
+
+
+def test_program_scene_tracked_by_events(mock, settle, panels, obs):
+    preview.track_program_scene(obs)
+    assert preview.program_scene == mock.program_scene
+    (other, _), = panels(1, mock.server_address)
+    other.req.set_current_program_scene('Gallery')
+    settle()
+    assert preview.program_scene == 'Gallery'
+    # Each frame is one request
+    mock.stats.clear()
+    for _ in range(3):
+        preview.decode_image(preview.request_image(100, 100).result())
+    assert mock.stats == {'GetSourceScreenshot': 3}
+
+
+def test_image_format_and_quality(obs):
+    preview.program_scene = 'Gallery'
+    def fetch(image_format, quality):
+        preview.image_format, preview.image_quality = image_format, quality
+        image, size, _ = preview.decode_image(preview.request_image(320, 412).result())
+        return image, size
+    sizes = { }
+    for image_format, quality, pil_format in [('png', -1, 'PNG'), ('jpg', 90, 'JPEG'),
+                                              ('jpg', 20, 'JPEG'), ('webp', 75, 'WEBP')]:
+        image, sizes[image_format, quality] = fetch(image_format, quality)
+        assert (image.format, image.size) == (pil_format, (320, 412))
+    assert sizes['jpg', 20] < sizes['jpg', 90]
+
+
+def test_producer_one_request_in_flight(mock, producer):
+    """With no delay, frames are asked for back to back, one at a time"""
+    mock.latency = 0.1
+    preview.program_scene = 'Gallery'
+    producer = producer(delay=0)
+    time.sleep(1.05)
+    requests = mock.stats['GetSourceScreenshot']
+    assert 7 <= requests <= 11
+    image, size, seconds = producer.frames.get()
+    assert image.size == producer.display and size > 0 and seconds >= 0
+    # The scene doesn't change, so only the first frame is decoded
+    assert producer.frames.get() is None
+    assert producer.skipped >= requests - 2
+
+
+def test_producer_skips_unchanged_frames(mock, producer):
+    preview.program_scene = 'Gallery'
+    producer = producer(delay=0.05, max_delay=0.4)
+    time.sleep(1.5)
+    # The same frame: decoded once, and asked for less and less often
+    assert producer.frames.get() is not None
+    assert producer.frames.get() is None
+    assert producer.interval == 0.4
+    assert producer.skipped == mock.stats['GetSourceScreenshot'] - 1 < 1.5 / 0.05 / 2
+    # A change is shown at once, and speeds it up again
+    preview.program_scene = 'Screenshare'
+    producer.wake()
+    woken = time.monotonic()
+    while producer.frames.get() is None:
+        time.sleep(0.001)
+    assert time.monotonic() - woken < 0.1
+    assert producer.interval < 0.4
+
+
+def test_request_size_buckets(monkeypatch):
+    monkeypatch.setattr(preview, 'aspect', 16 / 9)
+    monkeypatch.setattr(preview, 'max_size', 1280)
+    # Nearby window sizes share a screenshot size, shown scaled to fit
+    assert preview.request_size(500, 400) == ((640, 360), (500, 281))
+    assert preview.request_size(600, 400) == ((640, 360), (600, 338))
+    assert preview.request_size(1000, 300) == ((640, 360), (533, 300))  # fits the height
+    # At most max_size wide, and never tiny
+    assert preview.request_size(3000, 2000) == ((1280, 720), (3000, 1688))
+    assert preview.request_size(10, 10) == ((160, 90), (50, 28))
+    monkeypatch.setattr(preview, 'max_size', 800)
+    assert preview.request_size(700, 500) == ((800, 450), (700, 394))
+
+def test_start_size_keeps_canvas_aspect(monkeypatch):
+    monkeypatch.setattr(preview, 'aspect', 16 / 9)
+    assert preview.start_size() == ((480, 270), (420, 236))
+    monkeypatch.setattr(preview, 'aspect', 840 / 1080)
+    assert preview.start_size() == ((480, 617), (420, 540))
+
+def test_producer_resize(mock, producer):
+    preview.program_scene = 'Gallery'
+    producer = producer(delay=0.05)
+    while producer.frames.get() is None:
+        time.sleep(0.01)
+    producer.resize(*preview.request_size(900, 2000))
+    deadline = time.monotonic() + 5
+    frame = None
+    while frame is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+        frame = producer.frames.get()
+    # Shown even though the picture didn't change
+    assert frame is not None and frame[0].size == (900, round(900 / preview.aspect))
+
+
+def test_multiview_round_robin(mock, settle, obs):
+    preview.track_program_scene(obs)
+    preview.track_scenes(obs)
+    settle()
+    assert preview.scene_names == list(mock.scenes)
+    assert preview.preview_scene == mock.preview_scene
+    tiles = preview.multiview_tiles()
+    assert [tile[0] for tile in tiles] == ['preview', 'program'] + [('scene', name) for name in mock.scenes]
+    assert [tile[3] for tile in tiles] == [True, True] + [False] * len(mock.scenes)
+    mock.stats.clear()
+    multiview = preview.Multiview(delay=0.02, width=100)
+    try:
+        time.sleep(3 * len(tiles) * 0.02)
+    finally:
+        multiview.close()
+        multiview._thread.join(5)
+    # One screenshot at a time, whatever the number of tiles
+    assert len(tiles) * 2 <= mock.stats['GetSourceScreenshot'] <= len(tiles) * 3 + 1
+    assert set(multiview.frames) == {tile[0] for tile in tiles}
+    for key, _, _, big in tiles:
+        image = multiview.frames[key].get()[0]
+        width = 200 if big else 100
+        assert image.size == (width, round(width / preview.aspect))
+    # Later rounds are the same pictures
+    assert multiview.skipped >= len(tiles)
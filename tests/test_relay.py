@@ -0,0 +1,33 @@
+"""Panels syncing values through the relay, against the mock OBS."""
+
+from obs_cr.relay import PROFILE
+from obs_cr.wsserver import response
+
+
+def test_simultaneous_writers_through_relay(mock, relay, settle, panels, write_at_once):
+    """Re-saves by the newest writer reach OBS, even though the relay
+    has already seen that value in its event."""
+    states = panels(2, relay.server_address)
+    for trial in range(20):
+        name = f'key{trial}'
+        write_at_once(states, name)
+        settle()
+        values = {state._cache[name] for _, state in states}
+        assert len(values) == 1
+        assert mock.persistent[PROFILE, name]['value'] in values
+
+
+def test_late_write_response_keeps_newer_event_value(relay):
+    """A forwarded write answered after a newer value arrived in an
+    event doesn't replace it in the cache."""
+    slot = {'realm': PROFILE, 'slotName': 'k'}
+    relay.obs_event('CustomEvent', {'k': 2, '_sync': {'k': [2, 'b']}})
+    write = {'requestType': 'SetPersistentData', 'requestId': '1',
+             'requestData': dict(slot, slotValue={'value': 1, 'seq': 1, 'writer': 'a'})}
+    relay.learn(write, response(write))
+    read = {'requestType': 'GetPersistentData', 'requestId': '2', 'requestData': slot}
+    assert relay.cached(read)['responseData']['slotValue'] == {'value': 2, 'seq': 2, 'writer': 'b'}
+    # A newer write does replace it
+    write['requestData']['slotValue'] = {'value': 3, 'seq': 3, 'writer': 'a'}
+    relay.learn(write, response(write))
+    assert relay.cached(read)['responseData']['slotValue']['value'] == 3
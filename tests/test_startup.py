@@ -0,0 +1,46 @@
+"""Startup: what importing the panels costs, and a panel starting up"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+from obs_cr import control, mockobs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLOW = ['obsws_python', 'PIL', 'tktooltip', 'websocket']
+
+
+def test_import_is_light():
+    """Importing makes no Tk root and doesn't import the slow modules:
+    those wait until the window is shown."""
+    code = ('import json, sys\n'
+            'from obs_cr import control, preview\n'
+            f'print(json.dumps([control.root is None, [m for m in {SLOW!r} if m in sys.modules]]))\n')
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, stdout=subprocess.PIPE, check=True)
+    assert json.loads(out.stdout) == [True, [ ]]
+
+
+def test_panel_starts(display):
+    """The panel gets its initial values from the mock OBS (as in the bench)"""
+    mock = mockobs.start(latency=0.02,
+                         scenes=list(control.SCENE_NAMES), pip_scenes=control.SCENES_WITH_PIP,
+                         audio_inputs=[control.AUDIO_INPUT, control.AUDIO_INPUT_BRCD],
+                         media_inputs=[control.PLAYBACK_INPUT])
+    host, port = mock.server_address
+    try:
+        control.main([f'{host}:{port}', '', '--no-pip-poll'], mainloop=False)
+        control.root.withdraw()
+        deadline = time.monotonic() + 10
+        while control.obs._pending is not None and time.monotonic() < deadline:
+            control.root.update()
+            time.sleep(0.001)
+        assert control.obs._pending is None
+        assert control.obs.scene == mock.program_scene
+        assert control.obs.muted is True
+    finally:
+        control.obsreq.engine.close()
+        control.root.destroy()
+        mock.shutdown()
+        mock.server_close()
@@ -0,0 +1,102 @@
+"""obs_cr.util helpers"""
+
+import io
+import threading
+import time
+
+from obs_cr import util
+
+
+class FakeRoot:
+    def __init__(self):
+        self.idle = [ ]
+    def after_idle(self, func):
+        self.idle.append(func)
+    def run_idle(self):
+        idle, self.idle = self.idle, [ ]
+        for func in idle:
+            func()
+
+class FakeWidget:
+    def __init__(self):
+        self.configured = [ ]
+    def configure(self, **options):
+        self.configured.append(options)
+
+
+def test_repaint_coalesces_and_diffs():
+    root = FakeRoot()
+    repaint = util.Repaint(root)
+    a, b = FakeWidget(), FakeWidget()
+    repaint.configure(a, text='1', background='red')
+    repaint.configure(a, text='2')
+    repaint.configure(b, text='x')
+    assert len(root.idle) == 1 and a.configured == [ ]  # applied when idle
+    root.run_idle()
+    assert a.configured == [{'text': '2', 'background': 'red'}]
+    assert b.configured == [{'text': 'x'}]
+    # Only what changed is applied, and nothing if nothing did
+    repaint.configure(a, text='2', background='green')
+    repaint.configure(b, text='x')
+    root.run_idle()
+    assert a.configured[1:] == [{'background': 'green'}]
+    assert b.configured[1:] == [ ]
+
+def test_repaint_retries_failed_options():
+    root = FakeRoot()
+    repaint = util.Repaint(root)
+    widget = FakeWidget()
+    failing = [True]
+    def configure(**options):
+        if failing.pop():
+            raise RuntimeError('widget not ready')
+        widget.configured.append(options)
+    widget.configure = configure
+    repaint.configure(widget, text='1')
+    root.run_idle()
+    repaint.configure(widget, text='1')  # not remembered as applied
+    failing.append(False)
+    root.run_idle()
+    assert widget.configured == [{'text': '1'}]
+
+
+def test_phase_timer(monkeypatch):
+    now = [10.0]
+    monkeypatch.setattr(util.time, 'perf_counter', lambda: now[0])
+    timer = util.PhaseTimer()
+    now[0] += 0.5
+    timer.mark('tk')
+    now[0] += 0.25
+    timer.mark('connect', 'waiting')
+    assert timer.phases == [('tk', 0.5, ''), ('connect', 0.25, 'waiting')]
+    out = io.StringIO()
+    timer.report(file=out)
+    assert out.getvalue().split('\n') == ['tk         500.0 ms  ',
+                                          'connect    250.0 ms  waiting',
+                                          'total      750.0 ms', '']
+
+
+def test_newest_keeps_only_the_newest():
+    newest = util.Newest()
+    assert newest.get() is None
+    newest.put(1)
+    newest.put(2)
+    assert newest.get() == 2
+    assert newest.get() is None
+    # A slow consumer skips ahead, but always gets to the last item
+    got = [ ]
+    done = threading.Event()
+    def consume():
+        while not got or got[-1] != 999:
+            item = newest.get()
+            if item is not None:
+                got.append(item)
+            time.sleep(0.001)
+        done.set()
+    threading.Thread(target=consume, daemon=True).start()
+    for i in range(1000):
+        newest.put(i)
+        if i % 10 == 0:
+            time.sleep(0.001)
+    assert done.wait(5)
+    assert got == sorted(set(got)) and len(got) < 1000
@@ -0,0 +1,56 @@
+"""The obs-websocket server that the relay and the mock are made of."""
+
+import json
+import socket
+import threading
+import time
+
+from obs_cr import connection, wsserver
+
+
+def _stalled_client(address, subs):
+    """Connect and identify, then never read again"""
+    sock = socket.create_connection(address)
+    sock.sendall(b'GET / HTTP/1.1\r\nHost: x\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                 b'Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\n\r\n')
+    identify = json.dumps({'op': 1, 'd': {'rpcVersion': 1, 'eventSubscriptions': subs}}).encode()
+    sock.sendall(bytes([0x81, len(identify)]) + identify)
+    return sock
+
+
+def test_slow_client_doesnt_block_others(monkeypatch):
+    monkeypatch.setattr(wsserver.Session, 'MAX_QUEUE', 50)
+    server = wsserver.ObsWsServer(('127.0.0.1', 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stalled = _stalled_client(server.server_address, 1)
+    panel = connection.Supervisor(*server.server_address, None, subs=1)
+    got = [ ]
+    def on_custom_event(data):
+        got.append(data.n)
+    panel.callback.register(on_custom_event)
+    try:
+        while len(server.sessions) < 2:
+            time.sleep(0.01)
+        sent = 0
+        def flood():
+            # Only as fast as the panel reads, until the stalled client is dropped
+            nonlocal sent
+            while len(server.sessions) > 1 and sent < 5000:
+                server.broadcast('CustomEvent', 1, {'n': sent, 'padding': 'x' * 20000})
+                sent += 1
+                while len(got) < sent - 5:
+                    time.sleep(0.001)
+        thread = threading.Thread(target=flood, daemon=True)
+        thread.start()
+        thread.join(30)
+        assert not thread.is_alive(), 'broadcast() is blocked by the stalled client'
+        deadline = time.monotonic() + 5
+        while len(got) < sent and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert got == list(range(sent))
+        assert len(server.sessions) == 1  # The stalled client was dropped
+    finally:
+        panel.close()
+        stalled.close()
+        server.shutdown()
+        server.server_close()